@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# Compares the cold start of the two model artifact formats the inference server reads: the
+# three joblib pickles, and the model.bundle file (see src/container/model/bundle.py).
+#
+# Each repetition starts a fresh interpreter, as a new gunicorn worker would, which imports
+# the model code, loads the artifacts into a CompiledPredictor and predicts one row. The
+# child reports how long the import, the load and the first prediction took; the parent adds
+# the wall time of the whole process. The model directory must hold both formats, i.e. be the
+# output of a train.py run that writes the bundle.
+#
+# Usage:
+#   python benchmarks/artifact_load_benchmark.py --model-dir /opt/ml/model --repeat 20 \
+#       --output load.json
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_CODE_DIR = os.path.join(_REPO_DIR, "src", "container", "model")
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import inference
+from predictor import CompiledPredictor
+imported = time.perf_counter()
+predictor = CompiledPredictor(inference.load_bundle(sys.argv[1]))
+loaded = time.perf_counter()
+predictor.predict([[5.1, 3.5, 1.4, 0.2]])
+predicted = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "load_ms": (loaded - imported) * 1000,
+    "first_predict_ms": (predicted - loaded) * 1000,
+    "sklearn_imported": "sklearn" in sys.modules,
+}))
+"""
+
+FORMATS = {
+    "joblib": ("model.joblib", "scaler.joblib", "label_encoder.joblib"),
+    "bundle": ("model.bundle",),
+}
+
+
+def run_once(model_dir):
+    start = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, "-c", CHILD, model_dir], cwd=MODEL_CODE_DIR, text=True
+    )
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def summarize(runs):
+    summary = {"sklearn_imported": runs[0]["sklearn_imported"]}
+    for key in ("import_ms", "load_ms", "first_predict_ms", "process_ms"):
+        values = [run[key] for run in runs]
+        summary[key] = {
+            "median": float(np.median(values)),
+            "p90": float(np.percentile(values, 90)),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", default=os.environ.get("MODEL_DIR", "/opt/ml/model"))
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    runs = {name: [] for name in FORMATS}
+    with tempfile.TemporaryDirectory() as tmp:
+        format_dirs = {}
+        for name, files in FORMATS.items():
+            # Each format gets a directory of its own, so the server's format choice can't
+            # fall back to the other one.
+            format_dirs[name] = os.path.join(tmp, name)
+            os.makedirs(format_dirs[name])
+            for fname in files:
+                shutil.copy(os.path.join(args.model_dir, fname), format_dirs[name])
+            run_once(format_dirs[name])  # warm the OS page cache for both formats alike
+        # Alternate the formats so drift on the host affects both alike.
+        for _ in range(args.repeat):
+            for name, format_dir in format_dirs.items():
+                runs[name].append(run_once(format_dir))
+    results = {name: summarize(format_runs) for name, format_runs in runs.items()}
+
+    for name, summary in results.items():
+        print(
+            f"{name:7} import={summary['import_ms']['median']:7.1f}ms "
+            f"load={summary['load_ms']['median']:7.1f}ms "
+            f"first_predict={summary['first_predict_ms']['median']:6.2f}ms "
+            f"process={summary['process_ms']['median']:7.1f}ms "
+            f"(medians of {args.repeat}; sklearn imported: {summary['sklearn_imported']})",
+            file=sys.stderr,
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"repeat": args.repeat, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
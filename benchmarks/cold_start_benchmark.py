@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+# Measures the inference server's cold start: the time from launching `executor.sh serve` to
+# its first successful /invocations response.
+#
+# Each repetition launches the command, then polls the server until a single-row JSON Lines request
+# succeeds, recording when /ping first answered 200, when the first invocation succeeded and
+# how long that invocation itself took (the part of a cold start a real first caller would
+# see). The server is then stopped before the next repetition.
+#
+# The default command runs executor.sh from src/container/model, which needs nginx and the
+# model under /opt/ml/model, i.e. the container's file system. From the host, run the image
+# instead (see `make benchmark-cold-start`), or point --command at gunicorn directly:
+#
+#   python benchmarks/cold_start_benchmark.py --repeat 5 \
+#       --command 'docker run --rm -p 8080:8080 -v "$PWD/tests/test_container_mount:/opt/ml" cdk-model-test serve'
+#   MODEL_DIR=/opt/ml/model python benchmarks/cold_start_benchmark.py --url http://127.0.0.1:8081 \
+#       --command 'gunicorn -c gunicorn_config.py -k gevent -b 127.0.0.1:8081 -w 2 wsgi:app'
+
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+
+import numpy as np
+
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_CODE_DIR = os.path.join(_REPO_DIR, "src", "container", "model")
+
+BODY = json.dumps(
+    {"sepal_length": 5.1, "sepal_width": 3.5, "petal_length": 1.4, "petal_width": 0.2}
+).encode("utf-8")
+
+
+def request(url, method, path, body=None):
+    parsed = urllib.parse.urlparse(url)
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=10)
+    try:
+        headers = {"Content-Type": "application/jsonlines"} if body is not None else {}
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    except OSError:
+        return None
+    finally:
+        connection.close()
+
+
+def listening(url):
+    parsed = urllib.parse.urlparse(url)
+    try:
+        socket.create_connection((parsed.hostname, parsed.port), timeout=1).close()
+        return True
+    except ConnectionRefusedError:
+        return False
+    except OSError:
+        return True
+
+
+def run_once(command, url, timeout, poll_interval):
+    start = time.perf_counter()
+    # A session of its own, so nginx and the gunicorn workers can be stopped with it.
+    process = subprocess.Popen(command, shell=True, cwd=MODEL_CODE_DIR, start_new_session=True)
+    result = {"ping_ok_s": None}
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"the server exited with status {process.returncode}")
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"no successful invocation within {timeout}s")
+            if result["ping_ok_s"] is None and request(url, "GET", "/ping") == 200:
+                result["ping_ok_s"] = time.perf_counter() - start
+            sent = time.perf_counter()
+            if request(url, "POST", "/invocations", BODY) == 200:
+                done = time.perf_counter()
+                result["invocation_ok_s"] = done - start
+                result["first_invocation_ms"] = (done - sent) * 1000
+                if result["ping_ok_s"] is None:
+                    result["ping_ok_s"] = result["invocation_ok_s"]
+                return result
+            time.sleep(poll_interval)
+    finally:
+        stop(process, url)
+
+
+def stop(process, url, timeout=30):
+    def signal_group(signum):
+        try:
+            os.killpg(process.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    signal_group(signal.SIGTERM)
+    # The shell exits first; wait for the server behind it to let go of the port as well, so
+    # the next repetition doesn't talk to this one.
+    deadline = time.perf_counter() + timeout
+    while listening(url):
+        if time.perf_counter() > deadline:
+            signal_group(signal.SIGKILL)
+            deadline = float("inf")
+        time.sleep(0.1)
+    process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--command", default="./executor.sh serve")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.repeat):
+        runs.append(run_once(args.command, args.url, args.timeout, args.poll_interval))
+        print(
+            "ping ok at {ping_ok_s:6.2f}s, first invocation ok at {invocation_ok_s:6.2f}s "
+            "(took {first_invocation_ms:7.1f}ms)".format(**runs[-1]),
+            file=sys.stderr,
+        )
+
+    summary = {
+        key: float(np.median([run[key] for run in runs]))
+        for key in ("ping_ok_s", "invocation_ok_s", "first_invocation_ms")
+    }
+    print(
+        f"median of {args.repeat}: ping ok at {summary['ping_ok_s']:.2f}s, first invocation "
+        f"ok at {summary['invocation_ok_s']:.2f}s (took {summary['first_invocation_ms']:.1f}ms)",
+        file=sys.stderr,
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"command": args.command, "runs": runs, "median": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
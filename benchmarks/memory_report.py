@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# Measures the memory held by each gunicorn worker with and without MODEL_SERVER_PRELOAD.
+#
+# For each mode it starts gunicorn on a local TCP port (no nginx), sends enough requests for every
+# worker to have loaded the model, and then reads /proc/<pid>/smaps_rollup for the master and each
+# worker. RSS counts shared pages in full for every process, so PSS (shared pages split between
+# the processes mapping them) and USS (private pages only) are reported as well; USS is what each
+# additional worker actually costs.
+#
+# Usage:
+#   python benchmarks/memory_report.py [--workers N] [--port PORT] [--model-dir DIR]
+#
+# `make local-memory-report` runs it inside the container image, against the model code there
+# (--model-code-dir /opt/program).
+
+import argparse
+import concurrent.futures
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_CODE_DIR = os.path.join(_REPO_DIR, "src", "container", "model")
+
+SAMPLE_BODY = (
+    b'{"sepal_length": 5.1, "sepal_width": 3.5, "petal_length": 1.4, "petal_width": 0.2}\n'
+)
+
+
+def read_memory(pid):
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss_kb": fields.get("Rss", 0),
+        "pss_kb": fields.get("Pss", 0),
+        "uss_kb": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def child_pids(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def wait_for_workers(master_pid, workers, url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if len(child_pids(master_pid)) >= workers:
+            try:
+                urllib.request.urlopen(url + "/ping", timeout=5).read()
+                return
+            except (urllib.error.URLError, ConnectionError):
+                pass
+        time.sleep(0.2)
+    raise RuntimeError("gunicorn workers did not come up in time")
+
+
+def invoke(url):
+    request = urllib.request.Request(
+        url + "/invocations",
+        data=SAMPLE_BODY,
+        headers={"Content-Type": "application/jsonlines"},
+    )
+    return urllib.request.urlopen(request, timeout=60).status
+
+
+def measure(serve, preload, workers, port, model_dir):
+    url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, MODEL_DIR=model_dir, MODEL_SERVER_PRELOAD=str(preload).lower())
+    start = time.monotonic()
+    gunicorn = subprocess.Popen(
+        serve.gunicorn_command(f"127.0.0.1:{port}", workers=workers, preload=preload),
+        cwd=os.path.dirname(os.path.abspath(serve.__file__)),
+        env=serve.gunicorn_env(workers, env),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_workers(gunicorn.pid, workers, url)
+        startup_seconds = time.monotonic() - start
+
+        # Enough concurrent requests that every worker serves (and loads the model for) some.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers * 4) as pool:
+            list(pool.map(invoke, [url] * workers * 50))
+
+        worker_memory = [read_memory(pid) for pid in child_pids(gunicorn.pid)]
+        return {
+            "preload": preload,
+            "workers": workers,
+            "startup_seconds": round(startup_seconds, 3),
+            "master": read_memory(gunicorn.pid),
+            "per_worker": worker_memory,
+            "mean_worker": {
+                key: sum(w[key] for w in worker_memory) // len(worker_memory)
+                for key in ("rss_kb", "pss_kb", "uss_kb")
+            },
+            "total_pss_kb": read_memory(gunicorn.pid)["pss_kb"]
+            + sum(w["pss_kb"] for w in worker_memory),
+        }
+    finally:
+        gunicorn.terminate()
+        gunicorn.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, help="default: as serve.py would start")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--model-dir", default=os.environ.get("MODEL_DIR", "/opt/ml/model"))
+    parser.add_argument("--model-code-dir", default=MODEL_CODE_DIR)
+    args = parser.parse_args()
+
+    sys.path.insert(0, args.model_code_dir)
+    serve = importlib.import_module("serve")
+    workers = args.workers or serve.model_server_workers
+
+    report = [
+        measure(serve, preload, workers, args.port, args.model_dir) for preload in (False, True)
+    ]
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+    for result in report:
+        mean = result["mean_worker"]
+        print(
+            f"preload={result['preload']!s:5}  per worker: rss={mean['rss_kb']} kB "
+            f"pss={mean['pss_kb']} kB uss={mean['uss_kb']} kB  "
+            f"total pss={result['total_pss_kb']} kB",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
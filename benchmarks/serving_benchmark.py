@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+
+# Benchmarks the inference container's serving path and saves the results as JSON.
+#
+# Three kinds of run are supported:
+#
+#   in_process  requests go straight through app.app's Flask test client (no HTTP, no gunicorn),
+#               which isolates the cost of parsing, predicting and serializing
+#   server      gunicorn is started locally from serve.gunicorn_command for each worker count
+#               and driven over HTTP by a pool of client threads
+#   url         an already-running server (e.g. `make local-serve`, which includes nginx) is
+#               driven over HTTP
+#
+# Each run sweeps batch sizes (rows per request) and, over HTTP, client concurrency, using rows
+# drawn from per-class normal distributions fitted to data/train/iris.csv. Throughput and
+# p50/p95/p99 latency are reported for every combination. Over HTTP they cover successful
+# responses only, so that requests turned away by admission control (see
+# MODEL_SERVER_MAX_INFLIGHT_REQUESTS in serve.py) show up as errors rather than as fast requests.
+#
+# Usage:
+#   python benchmarks/serving_benchmark.py --model-dir /opt/ml/model --output results.json
+#   python benchmarks/serving_benchmark.py --modes server --workers 1 2 4 \
+#       --env MODEL_SERVER_BATCH_WAIT_MS=2 --output batched.json
+#   python benchmarks/serving_benchmark.py --compare results.json batched.json
+
+import argparse
+import concurrent.futures
+import datetime
+import http.client
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_CODE_DIR = os.path.join(_REPO_DIR, "src", "container", "model")
+TRAIN_DATA = os.path.join(_REPO_DIR, "data", "train", "iris.csv")
+
+FEATURE_NAMES = ("sepal_length", "sepal_width", "petal_length", "petal_width")
+
+
+######################
+## Synthetic inputs ##
+######################
+
+
+def generate_rows(n_rows, seed=0):
+    """Draw iris-like rows from a normal distribution per class, fitted to the training data."""
+    data = np.genfromtxt(TRAIN_DATA, delimiter=",", skip_header=1, dtype=None, encoding="utf-8")
+    features = np.array([list(row)[:4] for row in data], dtype=np.float64)
+    classes = np.array([row[4] for row in data])
+
+    rng = np.random.default_rng(seed)
+    labels = rng.choice(np.unique(classes), size=n_rows)
+    rows = np.empty((n_rows, len(FEATURE_NAMES)))
+    for label in np.unique(labels):
+        members = features[classes == label]
+        mask = labels == label
+        rows[mask] = rng.normal(members.mean(axis=0), members.std(axis=0), (mask.sum(), 4))
+    return np.round(np.clip(rows, 0.1, None), 1)
+
+
+def jsonlines_body(rows):
+    return "".join(
+        json.dumps(dict(zip(FEATURE_NAMES, row))) + "\n" for row in rows.tolist()
+    ).encode("utf-8")
+
+
+def make_bodies(batch_size, count=64, seed=0):
+    rows = generate_rows(batch_size * count, seed)
+    return [jsonlines_body(rows[i * batch_size : (i + 1) * batch_size]) for i in range(count)]
+
+
+#############
+## Drivers ##
+#############
+
+
+def summarize(latencies, errors, duration, batch_size, **labels):
+    latencies_ms = np.array(latencies) * 1000
+    requests = len(latencies)
+    result = dict(labels)
+    result.update(
+        {
+            "batch_size": batch_size,
+            "requests": requests,
+            "errors": errors,
+            "duration_seconds": round(duration, 3),
+            "throughput_rps": round(requests / duration, 1) if duration else 0.0,
+            "rows_per_second": round(requests * batch_size / duration, 1)
+            if duration
+            else 0.0,
+        }
+    )
+    if requests:
+        result["latency_ms"] = {
+            "mean": round(float(latencies_ms.mean()), 3),
+            "p50": round(float(np.percentile(latencies_ms, 50)), 3),
+            "p95": round(float(np.percentile(latencies_ms, 95)), 3),
+            "p99": round(float(np.percentile(latencies_ms, 99)), 3),
+            "max": round(float(latencies_ms.max()), 3),
+        }
+    return result
+
+
+def run_in_process(batch_sizes, duration):
+    sys.path.insert(0, MODEL_CODE_DIR)
+    import app
+
+    # app.py logs every request at DEBUG; that would dominate the numbers.
+    logging.getLogger().setLevel(logging.WARNING)
+    client = app.app.test_client()
+
+    results = []
+    for batch_size in batch_sizes:
+        bodies = make_bodies(batch_size)
+        client.post("/invocations", data=bodies[0], content_type="application/jsonlines")
+
+        latencies, errors = [], 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            body = bodies[len(latencies) % len(bodies)]
+            sent = time.perf_counter()
+            response = client.post(
+                "/invocations", data=body, content_type="application/jsonlines"
+            )
+            latencies.append(time.perf_counter() - sent)
+            errors += response.status_code != 200
+        results.append(
+            summarize(
+                latencies,
+                errors,
+                time.perf_counter() - start,
+                batch_size,
+                mode="in_process",
+                concurrency=1,
+            )
+        )
+        print_result(results[-1])
+    return results
+
+
+def drive_http(url, batch_size, concurrency, duration):
+    parsed = urllib.parse.urlparse(url)
+    bodies = make_bodies(batch_size)
+    deadline = time.perf_counter() + duration
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def client(index):
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=60)
+        own_latencies, own_errors = [], 0
+        i = index
+        while time.perf_counter() < deadline:
+            sent = time.perf_counter()
+            try:
+                connection.request(
+                    "POST",
+                    "/invocations",
+                    body=bodies[i % len(bodies)],
+                    headers={"Content-Type": "application/jsonlines"},
+                )
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                own_errors += 1
+                connection.close()
+                connection = http.client.HTTPConnection(
+                    parsed.hostname, parsed.port, timeout=60
+                )
+                continue
+            if response.status == 200:
+                own_latencies.append(time.perf_counter() - sent)
+            else:
+                own_errors += 1
+                # Back off as asked, like a well-behaved client, rather than hammering an
+                # overloaded server with immediate retries.
+                retry_after = response.getheader("Retry-After")
+                if retry_after:
+                    time.sleep(max(0.0, min(float(retry_after), deadline - time.perf_counter())))
+            i += concurrency
+        connection.close()
+        with lock:
+            latencies.extend(own_latencies)
+            errors[0] += own_errors
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def wait_until_ready(url, timeout=120, process=None):
+    parsed = urllib.parse.urlparse(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError("gunicorn exited before it became ready")
+        try:
+            connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=5)
+            connection.request("GET", "/ping")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready in {timeout}s")
+
+
+def run_http(url, batch_sizes, concurrencies, duration, **labels):
+    results = []
+    for batch_size in batch_sizes:
+        # One short unmeasured pass so lazy model loading doesn't land in the first run.
+        drive_http(url, batch_size, max(concurrencies), min(duration, 1.0))
+        for concurrency in concurrencies:
+            latencies, errors, elapsed = drive_http(url, batch_size, concurrency, duration)
+            results.append(
+                summarize(
+                    latencies,
+                    errors,
+                    elapsed,
+                    batch_size,
+                    concurrency=concurrency,
+                    **labels,
+                )
+            )
+            print_result(results[-1])
+    return results
+
+
+def run_server(worker_counts, batch_sizes, concurrencies, duration, port, env):
+    sys.path.insert(0, MODEL_CODE_DIR)
+    import serve
+
+    results = []
+    for workers in worker_counts:
+        process = subprocess.Popen(
+            serve.gunicorn_command(f"127.0.0.1:{port}", workers=workers),
+            cwd=MODEL_CODE_DIR,
+            env=serve.gunicorn_env(workers, env),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        url = f"http://127.0.0.1:{port}"
+        try:
+            wait_until_ready(url, process=process)
+            results += run_http(
+                url, batch_sizes, concurrencies, duration, mode="server", workers=workers
+            )
+        finally:
+            process.terminate()
+            process.wait()
+    return results
+
+
+###############
+## Reporting ##
+###############
+
+
+def print_result(result):
+    latency = result.get("latency_ms", {})
+    print(
+        f"{result['mode']:10} workers={result.get('workers', '-')!s:3} "
+        f"batch={result['batch_size']:<5} concurrency={result['concurrency']:<4} "
+        f"{result['throughput_rps']:>9.1f} req/s {result['rows_per_second']:>10.1f} rows/s  "
+        f"p50={latency.get('p50', 0):.2f}ms p95={latency.get('p95', 0):.2f}ms "
+        f"p99={latency.get('p99', 0):.2f}ms errors={result['errors']}",
+        file=sys.stderr,
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=_REPO_DIR,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return (
+        result["mode"],
+        result.get("workers"),
+        result["batch_size"],
+        result["concurrency"],
+    )
+
+
+def compare(baseline_path, candidate_path):
+    with open(baseline_path) as f:
+        baseline = {result_key(r): r for r in json.load(f)["results"]}
+    with open(candidate_path) as f:
+        candidate = json.load(f)["results"]
+
+    print(f"{'run':48} {'throughput':>22} {'p99 latency (ms)':>26}")
+    for result in candidate:
+        before = baseline.get(result_key(result))
+        if before is None or "latency_ms" not in before or "latency_ms" not in result:
+            continue
+        mode, workers, batch_size, concurrency = result_key(result)
+        name = f"{mode} workers={workers} batch={batch_size} concurrency={concurrency}"
+        throughput_change = (
+            result["throughput_rps"] / before["throughput_rps"] - 1
+            if before["throughput_rps"]
+            else 0.0
+        )
+        p99_change = result["latency_ms"]["p99"] / before["latency_ms"]["p99"] - 1
+        print(
+            f"{name:48} {before['throughput_rps']:>8.1f} -> {result['throughput_rps']:>8.1f} "
+            f"({throughput_change:+.0%}) {before['latency_ms']['p99']:>8.2f} -> "
+            f"{result['latency_ms']['p99']:>8.2f} ({p99_change:+.0%})"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--modes", nargs="+", default=["in_process", "server"], choices=["in_process", "server", "url"]
+    )
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--model-dir", default=os.environ.get("MODEL_DIR", "/opt/ml/model"))
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 10, 100, 1000])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, os.cpu_count()])
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per combination")
+    parser.add_argument("--port", type=int, default=8095)
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="extra environment for the app (e.g. MODEL_SERVER_BATCH_WAIT_MS=2)",
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CANDIDATE"),
+        help="compare two saved result files instead of running",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    os.environ.update(extra_env)
+    os.environ["MODEL_DIR"] = args.model_dir
+
+    results = []
+    if "in_process" in args.modes:
+        results += run_in_process(args.batch_sizes, args.duration)
+    if "server" in args.modes:
+        results += run_server(
+            sorted(set(args.workers)),
+            args.batch_sizes,
+            args.concurrency,
+            args.duration,
+            args.port,
+            dict(os.environ),
+        )
+    if "url" in args.modes:
+        wait_until_ready(args.url)
+        results += run_http(
+            args.url, args.batch_sizes, args.concurrency, args.duration, mode="url"
+        )
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "env": extra_env,
+        "duration_per_run_seconds": args.duration,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# Shows how submit_batch_inference sizes a batch transform job for a few input shapes, without
+# AWS: the S3 listing and record sample the planner reads are served by botocore's Stubber.
+#
+# For every scenario the report prints the plan (instances, concurrency per instance, payload
+# size) with its estimated duration and cost, next to the fixed configuration the lambda used
+# before (MaxPayloadInMB=6, the default concurrency of 1, all of --max-instances), estimated
+# with the same cost model.
+#
+# Usage:
+#   python benchmarks/transform_plan_report.py --instance-type ml.m5.xlarge --max-instances 8 \
+#       --max-cost 2.0
+
+import argparse
+import io
+import os
+import sys
+
+import boto3
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(_REPO_DIR, "src", "lambdas", "submit_batch_inference")
+
+BUCKET = "example-bucket"
+PREFIX = "batch_inference"
+RECORD = b'{"sepal_length":4.9,"sepal_width":3.1,"petal_length":1.5,"petal_width":0.1}\n'
+
+# name: object sizes in bytes
+SCENARIOS = {
+    "test file (30 records)": [30 * len(RECORD)],
+    "one 2 GB file": [2_000_000_000],
+    "40 x 50 MB files": [50_000_000] * 40,
+    "2500 x 1 MB files": [1_000_000] * 2500,
+    "skewed: 1 GB + 20 x 10 MB": [1_000_000_000] + [10_000_000] * 20,
+}
+
+
+def stubbed_s3(object_sizes, page_size=1000):
+    s3 = boto3.client(
+        "s3", region_name="us-east-1", aws_access_key_id="x", aws_secret_access_key="x"
+    )
+    stubber = Stubber(s3)
+    keys = [f"{PREFIX}/part-{i:05d}.jsonlines" for i in range(len(object_sizes))]
+    pages = [
+        list(zip(keys, object_sizes))[start : start + page_size]
+        for start in range(0, len(keys), page_size)
+    ]
+    for i, page in enumerate(pages):
+        expected = {"Bucket": BUCKET, "Prefix": PREFIX}
+        response = {
+            "Contents": [{"Key": key, "Size": size} for key, size in page],
+            "IsTruncated": i < len(pages) - 1,
+        }
+        if i > 0:
+            expected["ContinuationToken"] = f"page-{i}"
+        if i < len(pages) - 1:
+            response["NextContinuationToken"] = f"page-{i + 1}"
+        stubber.add_response("list_objects_v2", response, expected)
+
+    largest = max(range(len(keys)), key=lambda i: object_sizes[i])
+    sample = (RECORD * (planner.SAMPLE_BYTES // len(RECORD) + 1))[
+        : min(planner.SAMPLE_BYTES, object_sizes[largest])
+    ]
+    stubber.add_response(
+        "get_object",
+        {"Body": StreamingBody(io.BytesIO(sample), len(sample))},
+        {
+            "Bucket": BUCKET,
+            "Key": keys[largest],
+            "Range": f"bytes=0-{planner.SAMPLE_BYTES - 1}",
+        },
+    )
+    stubber.activate()
+    return s3, stubber
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--instance-type", default="ml.m5.large")
+    parser.add_argument("--max-instances", type=int, default=4)
+    parser.add_argument("--max-cost", type=float, default=1.0)
+    args = parser.parse_args()
+
+    for name, object_sizes in SCENARIOS.items():
+        s3, stubber = stubbed_s3(object_sizes)
+        sizes, record_bytes = planner.inspect_input(s3, f"s3://{BUCKET}/{PREFIX}")
+        stubber.assert_no_pending_responses()
+
+        plan = planner.plan_transform(
+            sizes, record_bytes, args.instance_type, args.max_instances, args.max_cost
+        )
+        # Without MaxConcurrentTransforms (and with no /execution-parameters endpoint in
+        # the container), batch transform sends one request at a time per instance.
+        fixed = planner.estimate(
+            sizes, args.max_instances, 1, 6, planner.INSTANCE_TYPES[args.instance_type][1]
+        )
+        print(f"{name:28} planned {plan}", file=sys.stderr)
+        print(f"{'':28} fixed   {fixed}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, LAMBDA_DIR)
+    import transform_plan as planner
+
+    main()
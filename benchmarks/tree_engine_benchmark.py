@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# Checks the NumPy tree engine (src/container/model/tree_engine.py) against XGBoost and times
+# both on a trained model.
+#
+# Parity is checked on the training data in data/train/iris.csv and on random rows drawn
+# across (and a little beyond) every feature's range, with some values missing; the script
+# exits with status 1 if any predicted class differs. Timings are the best of --repeat calls
+# of CompiledPredictor.predict per batch size, with the engine forced on and forced off.
+#
+# Usage:
+#   python benchmarks/tree_engine_benchmark.py --model-dir /opt/ml/model
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_CODE_DIR = os.path.join(_REPO_DIR, "src", "container", "model")
+TRAIN_DATA = os.path.join(_REPO_DIR, "data", "train", "iris.csv")
+
+
+def parity_inputs(predictor, n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    # Invert the scaler to get the raw feature range the model was trained on.
+    low = (0 - predictor.offset) / predictor.scale
+    high = (1 - predictor.offset) / predictor.scale
+    margin = (high - low) * 0.1
+    rows = rng.uniform(low - margin, high + margin, size=(n_rows, predictor.n_features))
+    rows[rng.random(rows.shape) < 0.02] = np.nan
+    inputs = [rows]
+    if os.path.exists(TRAIN_DATA):
+        data = pd.read_csv(TRAIN_DATA)
+        inputs.append(data[predictor.feature_names].to_numpy(dtype=np.float64))
+    return np.concatenate(inputs)
+
+
+def best_time(fn, batch, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(batch)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", default=os.environ.get("MODEL_DIR", "/opt/ml/model"))
+    parser.add_argument("--parity-rows", type=int, default=100000)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 16, 64, 256, 1024])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    sys.path.insert(0, MODEL_CODE_DIR)
+    import inference
+    from predictor import CompiledPredictor
+
+    bundle = inference.load_bundle(args.model_dir)
+    if bundle.trees is None:
+        print("This model can't be evaluated by the NumPy tree engine.", file=sys.stderr)
+        sys.exit(1)
+    native = CompiledPredictor(bundle, tree_engine="native")
+    numpy_engine = CompiledPredictor(bundle, tree_engine="numpy")
+
+    rows = parity_inputs(native, args.parity_rows)
+    mismatches = int(np.sum(native.predict(rows) != numpy_engine.predict(rows)))
+    print(
+        f"{len(bundle.trees.roots)} trees, depth {bundle.trees.max_depth}: "
+        f"{mismatches} of {len(rows)} predictions differ from XGBoost",
+        file=sys.stderr,
+    )
+
+    for batch_size in args.batch_sizes:
+        batch = rows[:batch_size]
+        native_us = best_time(native.predict, batch, args.repeat) * 1e6
+        numpy_us = best_time(numpy_engine.predict, batch, args.repeat) * 1e6
+        print(
+            f"batch={batch_size:<5} native={native_us:9.1f}us numpy={numpy_us:9.1f}us "
+            f"speedup={native_us / numpy_us:5.2f}x",
+            file=sys.stderr,
+        )
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
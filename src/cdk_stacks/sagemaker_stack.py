@@ -1,6 +1,7 @@
 import os
 from aws_cdk import (
     CfnParameter,
+    Duration,
     Stack,
     App,
     aws_iam as iam,
@@ -153,12 +154,21 @@ class SagemakerStack(Stack):
             "model_name": MODEL_NAME,
             "role_arn": sagemaker_execution_role.role_arn,
             "train_data_uri": bucket.s3_url_for_object(key="train"),
+            # Outside the "train" prefix, which the training channel reads in full.
+            "output_uri": bucket.s3_url_for_object(key="model_artifacts"),
             "resource_config": {
                 "instance_type": "ml.m5.large",
                 "instance_count": 1,
                 "volume_size": 10,
             },
             "use_spot_training": True,
+            "training_input_mode": "File",
+            "max_runtime_seconds": 900,
+            "max_wait_seconds": 1000,
+            "checkpoint_uri": bucket.s3_url_for_object(key="checkpoints"),
+            # Training options for train.py. "fit" keeps the original workflow; callers can
+            # opt in to e.g. training_mode "budgeted" through the event's hyperparameters.
+            "hyperparameters": {"training_mode": "fit"},
         }
 
         training_submit_lambda_role = iam.Role(
@@ -173,6 +183,7 @@ class SagemakerStack(Stack):
                 actions=[
                     "sagemaker:CreateTrainingJob",
                     "sagemaker:DescribeTrainingJob",
+                    "sagemaker:ListTrainingJobs",
                 ],
                 resources=["*"],
             ),
@@ -185,12 +196,21 @@ class SagemakerStack(Stack):
             ),
         )
 
+        # Code both submission lambdas use, e.g. finding a model's latest training job.
+        shared_lambda_layer = _lambda.LayerVersion(
+            self,
+            "sharedLambdaLayer",
+            code=_lambda.Code.from_asset("src/lambdas/shared/"),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_9],
+        )
+
         training_submit_lambda = _lambda.Function(
             self,
             "submitTrainingLambda",
             handler="app.lambda_handler",
             runtime=_lambda.Runtime.PYTHON_3_9,
             code=_lambda.Code.from_asset("src/lambdas/submit_training/"),
+            layers=[shared_lambda_layer],
             role=training_submit_lambda_role,
         )
 
@@ -212,7 +232,12 @@ class SagemakerStack(Stack):
         inference_job_config = {
             "model_name": MODEL_NAME,
             "inference_data_uri": bucket.s3_url_for_object(key="batch_inference"),
-            "resource_config": {"instance_type": "ml.m5.large", "instance_count": 1,},
+            # instance_count is the most the job may use; see submit_batch_inference.
+            "resource_config": {
+                "instance_type": "ml.m5.large",
+                "instance_count": 4,
+                "max_cost_usd": 1.0,
+            },
         }
 
         inference_submit_lambda_role = iam.Role(
@@ -235,6 +260,8 @@ class SagemakerStack(Stack):
                 resources=["*"],
             ),
         )
+        # The job is sized from the input objects' sizes and a sample of their records.
+        bucket.grant_read(inference_submit_lambda_role)
         inference_submit_lambda_role.add_to_policy(
             iam.PolicyStatement(
                 effect=iam.Effect.ALLOW,
@@ -249,7 +276,10 @@ class SagemakerStack(Stack):
             handler="app.lambda_handler",
             runtime=_lambda.Runtime.PYTHON_3_9,
             code=_lambda.Code.from_asset("src/lambdas/submit_batch_inference/"),
+            layers=[shared_lambda_layer],
             role=inference_submit_lambda_role,
+            # Listing a large input prefix can take longer than the default 3 seconds.
+            timeout=Duration.seconds(60),
         )
 
         inference_step_function = _aws_stepfunctions.StateMachine(
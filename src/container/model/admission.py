@@ -0,0 +1,82 @@
+import threading
+import time
+
+
+class AdmissionController:
+    """Bounds the invocations a worker works on at once, in requests and in rows.
+
+    Under gunicorn's gevent worker every accepted connection gets its own greenlet, so without
+    a bound an overloaded worker keeps taking requests that all slow each other down. Requests
+    beyond `max_requests` are turned away before their body is read, and requests whose rows
+    would take the rows in flight past `max_rows` right after they are decoded, so callers can
+    retry elsewhere or later instead of timing out. A request is always let through when
+    nothing else is in flight, however many rows it has. A limit of 0 disables that bound.
+    """
+
+    def __init__(self, max_requests, max_rows):
+        self.max_requests = max_requests
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rows = 0
+        self.stats = {"rejected_requests": 0, "rejected_rows": 0, "expired": 0}
+
+    def admit(self):
+        """Take a request slot; False if the worker is full."""
+        with self._lock:
+            if self.max_requests and self.requests >= self.max_requests:
+                self.stats["rejected_requests"] += 1
+                return False
+            self.requests += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.requests -= 1
+
+    def reserve_rows(self, n_rows, force=False):
+        """Count `n_rows` as in flight; False (and nothing counted) if they don't fit, unless
+        `force`d, e.g. for the later chunks of a response that is already streaming."""
+        with self._lock:
+            if (
+                not force
+                and self.max_rows
+                and self.rows
+                and self.rows + n_rows > self.max_rows
+            ):
+                self.stats["rejected_rows"] += 1
+                return False
+            self.rows += n_rows
+            return True
+
+    def release_rows(self, n_rows):
+        with self._lock:
+            self.rows -= n_rows
+
+    def expired(self, deadline):
+        """Whether the time.time() `deadline` (None for none) has passed; counts it if so."""
+        if deadline is None or time.time() < deadline:
+            return False
+        with self._lock:
+            self.stats["expired"] += 1
+        return True
+
+
+def request_deadline(headers, deadline_header, start_header):
+    """The time.time() by which the caller needs the response, from a `deadline_header` giving
+    a budget in milliseconds; None without one. The budget runs from the time nginx stamped in
+    `start_header` ("t=<seconds>"), if any, so time spent queued in front of the worker counts."""
+    budget = headers.get(deadline_header)
+    if not budget:
+        return None
+    try:
+        budget_seconds = float(budget) / 1000
+    except ValueError:
+        return None
+    start = time.time()
+    stamp = headers.get(start_header, "")
+    try:
+        start = min(start, float(stamp[2:] if stamp.startswith("t=") else stamp))
+    except ValueError:
+        pass
+    return start + budget_seconds
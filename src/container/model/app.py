@@ -1,17 +1,45 @@
 import json
-import io
-import pandas as pd
+import os
+import time
 import flask
 import inference
+import metrics
+import serialization
 import logging
+from admission import AdmissionController, request_deadline
+from model_cache import ModelNotFound, model_name
 
 logging.basicConfig(level=logging.DEBUG)
 
+# Rows per chunk when streaming JSON Lines responses; 0 buffers every response in full.
+STREAM_CHUNK_ROWS = int(os.environ.get("MODEL_SERVER_STREAM_CHUNK_ROWS", 0))
+# Names the model an invocation is for in multi-model mode (MODEL_SERVER_MODELS_DIR), as with
+# SageMaker multi-model endpoints; ignored otherwise.
+TARGET_MODEL_HEADER = "X-Amzn-SageMaker-Target-Model"
+# Invocations (and their rows) a worker works on at once; 0 for no limit. Requests over the
+# limit are answered right away with REJECT_STATUS and a Retry-After of RETRY_AFTER seconds.
+MAX_INFLIGHT_REQUESTS = int(os.environ.get("MODEL_SERVER_MAX_INFLIGHT_REQUESTS", 0))
+MAX_INFLIGHT_ROWS = int(os.environ.get("MODEL_SERVER_MAX_INFLIGHT_ROWS", 0))
+REJECT_STATUS = int(os.environ.get("MODEL_SERVER_REJECT_STATUS", 503))
+RETRY_AFTER = int(os.environ.get("MODEL_SERVER_RETRY_AFTER", 1))
+# Optional budget, in milliseconds, the caller gives a request; once it has run out the request
+# is answered with a 504 instead of being predicted. It counts from the time nginx received the
+# request, which it passes on in REQUEST_START_HEADER.
+DEADLINE_HEADER = "X-Model-Server-Deadline-Ms"
+REQUEST_START_HEADER = "X-Request-Start"
+
+admission = AdmissionController(MAX_INFLIGHT_REQUESTS, MAX_INFLIGHT_ROWS)
+metrics.register_stats("admission", admission.stats)
+
 app = flask.Flask(__name__)
 
 
 @app.route("/ping", methods=["GET", "POST"])
 def ping():
+    # Healthy only once this worker has loaded and warmed the model (normally done before it
+    # accepted any connection, see gunicorn_config.py); until then, keep trying on each ping.
+    if not inference.ready():
+        return json_response({"message": "Model not loaded"}, 503)
     return flask.Response(
         response=json.dumps({"message": "Status okay"}),
         status=200,
@@ -19,32 +47,214 @@ def ping():
     )
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return flask.Response(
+        response=metrics.render_prometheus(),
+        status=200,
+        mimetype="text/plain; version=0.0.4",
+    )
+
+
+@app.before_request
+def admit_invocation():
+    if flask.request.endpoint != "invocations":
+        return None
+    flask.g.deadline = request_deadline(
+        flask.request.headers, DEADLINE_HEADER, REQUEST_START_HEADER
+    )
+    if not admission.admit():
+        logging.debug("Rejected request. The worker is at its in-flight request limit.")
+        return overloaded_response()
+    flask.g.admitted = True
+    return None
+
+
+@app.teardown_request
+def release_invocation(exc):
+    # For streamed responses this runs once the whole body has been sent.
+    release_rows()
+    if flask.g.pop("admitted", False):
+        admission.release()
+
+
+@app.after_request
+def record_invocation(response):
+    if flask.request.endpoint == "invocations":
+        metrics.count_response(response.status_code)
+        metrics.sync_stats()
+    return response
+
+
 @app.route("/invocations", methods=["GET", "POST"])
 def invocations():
     logging.debug("Request registered. Starting prediction.")
-    if flask.request.content_type == "application/jsonlines":
-        logging.debug("Parsing the body of the request.")
-        data = flask.request.data.decode("utf-8")
-        s = io.StringIO(data)
-        df = pd.read_json(s, lines=True)
-    else:
+    decoder = serialization.DECODERS.get(flask.request.mimetype)
+    if decoder is None:
         logging.debug(
-            f"Bad request. Received content of type '{flask.request.content_type}' when expected JSON Lines."
+            f"Bad request. Received content of type '{flask.request.content_type}', which is not supported."
+        )
+        return json_response(
+            {
+                "message": "This predictor only supports the content types "
+                + ", ".join(serialization.DECODERS)
+            },
+            415,
         )
-        return flask.Response(
-            response=json.dumps(
-                {"message": "This predictor only supports JSON Lines data"}
-            ),
-            status=415,
-            mimetype="application/json",
+
+    response_type, mimetype = negotiate_response_type(flask.request.accept_mimetypes)
+    if response_type is None:
+        logging.debug(f"Bad request. Cannot produce any of '{flask.request.accept_mimetypes}'.")
+        return json_response(
+            {
+                "message": "This predictor can only respond with "
+                + ", ".join(serialization.ENCODERS)
+            },
+            406,
         )
 
+    model = None
+    if inference.models is not None:
+        target = flask.request.headers.get(TARGET_MODEL_HEADER)
+        if not target:
+            logging.debug(f"Bad request. No {TARGET_MODEL_HEADER} header.")
+            return json_response(
+                {"message": f"Multi-model requests need a {TARGET_MODEL_HEADER} header"}, 400
+            )
+        try:
+            name = model_name(target)
+            model = inference.get_model(name)
+        except ModelNotFound as e:
+            logging.debug(f"Model not found. {e}")
+            return json_response({"message": str(e)}, 404)
+        metrics.increment_model(name, "requests")
+
+    if (
+        STREAM_CHUNK_ROWS
+        and decoder is serialization.decode_jsonlines
+        and response_type in (serialization.JSONLINES, serialization.CSV)
+    ):
+        return stream_invocations(serialization.ENCODERS[response_type], mimetype, model)
+
+    logging.debug("Parsing the body of the request.")
+    try:
+        with metrics.timed("parse"):
+            features = decoder(flask.request.get_data(), inference.feature_names(model))
+    except serialization.PayloadError as e:
+        logging.debug(f"Bad request. {e}")
+        return json_response({"message": str(e)}, 400)
+
+    if not reserve_rows(len(features)):
+        logging.debug("Rejected request. The worker is at its in-flight row limit.")
+        return overloaded_response()
+    if admission.expired(flask.g.deadline):
+        logging.debug("Dropped request. Its deadline passed before prediction.")
+        return deadline_response()
+
     logging.debug("Making predictions on the data now.")
-    result = inference.predict(df)
+    result = inference.predict_features(features, model)
+    metrics.increment("predicted_rows", len(result))
     logging.debug("Prediction successful. Responding to request.")
 
+    with metrics.timed("serialize"):
+        body = serialization.ENCODERS[response_type](result)
+    return flask.Response(response=body, status=200, mimetype=mimetype)
+
+
+def stream_invocations(encoder, mimetype, model=None):
+    chunks = serialization.iter_jsonlines_chunks(
+        flask.request.stream, STREAM_CHUNK_ROWS, inference.feature_names(model)
+    )
+
+    # Decode the first chunk up front so a malformed payload is still answered with a 400
+    # rather than with a broken 200.
+    logging.debug("Parsing the first chunk of the request.")
+    try:
+        with metrics.timed("parse"):
+            first = next(chunks, None)
+    except serialization.PayloadError as e:
+        logging.debug(f"Bad request. {e}")
+        return json_response({"message": str(e)}, 400)
+    if first is not None and not reserve_rows(len(first)):
+        logging.debug("Rejected request. The worker is at its in-flight row limit.")
+        return overloaded_response()
+    if admission.expired(flask.g.deadline):
+        logging.debug("Dropped request. Its deadline passed before prediction.")
+        return deadline_response()
+
+    def predict_chunk(features):
+        # Only the chunk being predicted counts as in flight. Once the response has started
+        # it can't be turned away any more, so later chunks are let through regardless.
+        if not flask.g.get("reserved_rows"):
+            reserve_rows(len(features), force=True)
+        result = inference.predict_features(features, model)
+        release_rows()
+        metrics.increment("predicted_rows", len(result))
+        with metrics.timed("serialize"):
+            return encoder(result)
+
+    def generate():
+        if first is None:
+            return
+        yield predict_chunk(first)
+        try:
+            while True:
+                start = time.perf_counter()
+                features = next(chunks, None)
+                if features is None:
+                    break
+                metrics.observe("parse", time.perf_counter() - start)
+                yield predict_chunk(features)
+        except serialization.PayloadError as e:
+            # The status line has already been sent; re-raising aborts the response so the
+            # client sees a truncated body instead of a silently partial success.
+            logging.error(f"Bad request part way through a streamed response. {e}")
+            raise
+        logging.debug("Streamed prediction successful.")
+
     return flask.Response(
-        response=result.to_json(orient="records", lines=True),
-        status=200,
-        mimetype="application/json",
+        flask.stream_with_context(generate()), status=200, mimetype=mimetype
+    )
+
+
+def negotiate_response_type(accept):
+    # Without an Accept header, with a wildcard one, or when asked for application/json (as
+    # the SageMaker SDK's JSONDeserializer does), respond the way this endpoint always has:
+    # JSON Lines labelled as application/json.
+    if not accept or accept.best == "*/*":
+        return serialization.JSONLINES, "application/json"
+    response_type = accept.best_match(list(serialization.ENCODERS) + ["application/json"])
+    if response_type == "application/json":
+        return serialization.JSONLINES, "application/json"
+    return response_type, response_type
+
+
+def reserve_rows(n_rows, force=False):
+    if not admission.reserve_rows(n_rows, force):
+        return False
+    flask.g.reserved_rows = flask.g.get("reserved_rows", 0) + n_rows
+    return True
+
+
+def release_rows():
+    admission.release_rows(flask.g.pop("reserved_rows", 0))
+
+
+def overloaded_response():
+    response = json_response(
+        {"message": "The server is at capacity. Retry later."}, REJECT_STATUS
+    )
+    response.headers["Retry-After"] = str(RETRY_AFTER)
+    return response
+
+
+def deadline_response():
+    return json_response(
+        {"message": f"The request's {DEADLINE_HEADER} passed before it was predicted."}, 504
+    )
+
+
+def json_response(body, status):
+    return flask.Response(
+        response=json.dumps(body), status=status, mimetype="application/json",
     )
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+# Scores a JSON Lines or CSV file with the model in MODEL_DIR without going through the
+# inference server: `executor.sh batch <input> <output>`.
+#
+# The input is read in chunks of whole lines, each copied once into a shared memory block
+# that a pool of worker processes decodes, predicts and encodes; only the block's name and
+# the encoded predictions cross the process boundary. Predictions are written in input
+# order, one line per non-blank input line, in the same format the /invocations endpoint
+# produces. CSV inputs may start with a header row, which is handed to every worker.
+#
+# Usage:
+#   python batch_score.py data.jsonlines predictions.jsonlines --workers 4
+#   python batch_score.py data.csv - --output-format jsonlines > predictions.jsonlines
+
+import argparse
+import collections
+import concurrent.futures
+import logging
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import shared_memory
+
+import serialization
+
+logging.basicConfig(level=logging.INFO)
+
+MODEL_DIR = os.environ.get("MODEL_DIR", "/opt/ml/model")
+
+FORMATS = {"jsonlines": serialization.JSONLINES, "csv": serialization.CSV}
+
+
+def input_format(path):
+    return "csv" if path.lower().endswith(".csv") else "jsonlines"
+
+
+def read_chunks(f, chunk_bytes):
+    """Yield (first line number, lines) for runs of whole lines of about `chunk_bytes`."""
+    first_line = 1
+    while True:
+        lines = f.readlines(chunk_bytes)
+        if not lines:
+            return
+        yield first_line, lines
+        first_line += len(lines)
+
+
+def split_header(f, fmt):
+    """Read the CSV header row, if any, off `f`; returns it and the lines read past it."""
+    if fmt != "csv":
+        return b"", []
+    first = f.readline()
+    # Like decode_csv: a header is a first row whose first field isn't a number (or blank).
+    field = first.split(b",", 1)[0].strip().strip(b'"')
+    try:
+        float(field or 0)
+    except ValueError:
+        return first, []
+    return b"", [first] if first else []
+
+
+#############
+## Workers ##
+#############
+
+
+_worker = {}
+
+
+def _init_worker(model_dir, fmt, output_fmt, header, nthread):
+    # Imported here so the parent, which only moves bytes around, never loads the model code.
+    import inference
+    from predictor import CompiledPredictor
+
+    predictor = CompiledPredictor(
+        inference.load_bundle(model_dir), tree_engine="native", nthread=nthread
+    )
+    _worker.update(
+        predictor=predictor,
+        decode=serialization.DECODERS[FORMATS[fmt]],
+        encode=serialization.ENCODERS[FORMATS[output_fmt]],
+        feature_names=predictor.feature_names or serialization.FEATURE_NAMES,
+        header=header,
+    )
+
+
+def _score_chunk(block_name, size, first_line):
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        body = _worker["header"] + bytes(block.buf[:size])
+    finally:
+        block.close()
+    try:
+        features = _worker["decode"](body, _worker["feature_names"])
+    except serialization.PayloadError as e:
+        raise serialization.PayloadError(
+            f"In the chunk starting at input line {first_line}: {e}"
+        ) from None
+    return _worker["encode"](_worker["predictor"].predict(features)), len(features)
+
+
+##########
+## Main ##
+##########
+
+
+def score(input_file, output_file, fmt, output_fmt, workers, chunk_bytes, model_dir=MODEL_DIR):
+    """Score `input_file` into `output_file` (both binary); returns the number of rows."""
+    header, pending = split_header(input_file, fmt)
+    chunks = read_chunks(input_file, chunk_bytes)
+    if pending:
+        chunks = _prepend(pending, chunks)
+
+    nthread = max(1, (os.cpu_count() or 1) // workers)
+    # Enough chunks in flight to keep every worker busy while the oldest one is written out.
+    window = 2 * workers
+    blocks = []
+    in_flight = collections.deque()
+    rows = 0
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(model_dir, fmt, output_fmt, header, nthread),
+        ) as pool:
+            for i, (first_line, lines) in enumerate(chunks):
+                if len(in_flight) == window:
+                    rows += _write_result(in_flight.popleft(), output_file)
+                # Blocks are reused round robin: the one for chunk i was last used by chunk
+                # i - window, which has just been written out.
+                data = b"".join(lines)
+                slot = i % window
+                if slot == len(blocks) or blocks[slot].size < len(data):
+                    block = shared_memory.SharedMemory(
+                        create=True, size=max(len(data), chunk_bytes)
+                    )
+                    if slot < len(blocks):
+                        _release(blocks[slot])
+                        blocks[slot] = block
+                    else:
+                        blocks.append(block)
+                blocks[slot].buf[: len(data)] = data
+                in_flight.append(
+                    pool.submit(_score_chunk, blocks[slot].name, len(data), first_line)
+                )
+            while in_flight:
+                rows += _write_result(in_flight.popleft(), output_file)
+    finally:
+        for future in in_flight:
+            future.cancel()
+        for block in blocks:
+            _release(block)
+    return rows
+
+
+def _prepend(lines, chunks):
+    first = next(chunks, None)
+    if first is None:
+        yield 1, lines
+        return
+    yield 1, lines + first[1]
+    yield from chunks
+
+
+def _write_result(future, output_file):
+    body, rows = future.result()
+    output_file.write(body)
+    return rows
+
+
+def _release(block):
+    block.close()
+    block.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Score a JSON Lines or CSV file with the model in MODEL_DIR."
+    )
+    parser.add_argument("input", help="input file, or - for stdin")
+    parser.add_argument("output", help="output file, or - for stdout")
+    parser.add_argument("--input-format", choices=FORMATS, help="default: from the file name")
+    parser.add_argument(
+        "--output-format", choices=FORMATS, help="default: the input format"
+    )
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-bytes", type=int, default=4 << 20)
+    args = parser.parse_args()
+
+    fmt = args.input_format or input_format(args.input)
+    output_fmt = args.output_format or fmt
+
+    # Keep the workers' prediction metrics out of a running server's /metrics totals.
+    metrics_dir = tempfile.TemporaryDirectory()
+    os.environ["MODEL_SERVER_METRICS_DIR"] = metrics_dir.name
+
+    input_file = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    output_file = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    start = time.perf_counter()
+    try:
+        rows = score(
+            input_file, output_file, fmt, output_fmt, args.workers, args.chunk_bytes,
+            args.model_dir,
+        )
+    except serialization.PayloadError as e:
+        logging.error(f"Couldn't score {args.input}: {e}")
+        sys.exit(1)
+    finally:
+        input_file.close()
+        output_file.close()
+        metrics_dir.cleanup()
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"Scored {rows} rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s) "
+        f"with {args.workers} worker(s)."
+    )
+
+
+if __name__ == "__main__":
+    main()
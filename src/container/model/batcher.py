@@ -0,0 +1,89 @@
+import threading
+
+import numpy as np
+
+
+class _Request:
+    def __init__(self, features):
+        self.features = features
+        self.batched = False
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Coalesces concurrent predict calls within a worker into one vectorized call.
+
+    The first caller to arrive opens a batch and waits up to `max_wait_seconds` for others to
+    join; whoever fills the batch to `max_batch_rows` (or the opener, once its wait expires)
+    runs the prediction for everyone and hands each caller back its own rows. There is no
+    background thread: under gunicorn's gevent worker `threading` is monkey-patched, so the
+    waits below just yield to the other in-flight requests.
+    """
+
+    def __init__(self, predict_fn, max_batch_rows, max_wait_seconds):
+        self.predict_fn = predict_fn
+        self.max_batch_rows = max_batch_rows
+        self.max_wait_seconds = max_wait_seconds
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_rows = 0
+        self.stats = {"requests": 0, "batches": 0, "rows": 0}
+
+    def predict(self, features):
+        if self.max_wait_seconds <= 0 or len(features) >= self.max_batch_rows:
+            return self.predict_fn(features)
+
+        request = _Request(features)
+        batch = None
+        with self._lock:
+            self._pending.append(request)
+            self._pending_rows += len(features)
+            opener = len(self._pending) == 1
+            if self._pending_rows >= self.max_batch_rows:
+                batch = self._take_pending()
+
+        if batch is None and opener:
+            request.done.wait(self.max_wait_seconds)
+            with self._lock:
+                if not request.batched:
+                    batch = self._take_pending()
+
+        if batch is not None:
+            self._run(batch)
+        request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _take_pending(self):
+        batch = self._pending
+        for request in batch:
+            request.batched = True
+        self._pending = []
+        self._pending_rows = 0
+        return batch
+
+    def _run(self, batch):
+        try:
+            if len(batch) == 1:
+                results = [self.predict_fn(batch[0].features)]
+            else:
+                predictions = self.predict_fn(
+                    np.concatenate([request.features for request in batch])
+                )
+                offsets = np.cumsum([len(request.features) for request in batch])[:-1]
+                results = np.split(predictions, offsets)
+            for request, result in zip(batch, results):
+                request.result = result
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        finally:
+            self.stats["requests"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["rows"] += sum(len(request.features) for request in batch)
+            for request in batch:
+                request.done.set()
@@ -0,0 +1,144 @@
+import json
+import os
+
+import numpy as np
+import xgboost as xgb
+
+from tree_engine import ARRAY_FIELDS, TreeEnsemble
+
+
+# Everything the predictor needs, in one file that is read without pickle: an uncompressed
+# .npz holding the booster in XGBoost's UBJSON format, the scaler's affine coefficients and
+# the label classes as plain arrays, and a JSON manifest. Unlike the joblib artifacts, loading
+# it doesn't import sklearn or depend on the sklearn/xgboost versions it was written with
+# (beyond XGBoost's own model format compatibility). Bundles written since the NumPy tree
+# engine was added also hold its arrays, so servers don't have to export them on load.
+BUNDLE_NAME = "model.bundle"
+BUNDLE_FORMAT = "iris-xgboost-bundle"
+BUNDLE_VERSION = 1
+
+
+class ModelBundle:
+    def __init__(
+        self,
+        booster,
+        objective,
+        scale,
+        offset,
+        clip,
+        classes,
+        feature_names,
+        iteration_range,
+        trees=None,
+        manifest=None,
+    ):
+        self.booster = booster
+        self.objective = objective
+        self.scale = scale
+        self.offset = offset
+        self.clip = clip
+        self.classes = classes
+        self.feature_names = feature_names
+        self.iteration_range = iteration_range
+        self.trees = trees
+        self.manifest = manifest or {}
+
+    @classmethod
+    def from_artifacts(cls, model, scaler, label_encoder):
+        try:
+            iteration_range = (0, int(model.best_iteration) + 1)
+        except AttributeError:
+            iteration_range = (0, 0)
+        classes = np.asarray(label_encoder.classes_)
+        if classes.dtype == object:
+            # Fixed-width unicode labels can be serialized (e.g. to .npy) without pickle.
+            classes = classes.astype(str)
+        booster = model.get_booster()
+        return cls(
+            booster=booster,
+            objective=model.get_params().get("objective") or "",
+            scale=np.ascontiguousarray(scaler.scale_, dtype=np.float64),
+            offset=np.ascontiguousarray(scaler.min_, dtype=np.float64),
+            clip=(
+                tuple(float(v) for v in scaler.feature_range)
+                if getattr(scaler, "clip", False)
+                else None
+            ),
+            classes=classes,
+            feature_names=(
+                [str(name) for name in scaler.feature_names_in_]
+                if hasattr(scaler, "feature_names_in_")
+                else None
+            ),
+            iteration_range=iteration_range,
+            trees=TreeEnsemble.from_booster(booster, iteration_range),
+        )
+
+
+def write_bundle(path, bundle):
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "objective": bundle.objective,
+        "iteration_range": list(bundle.iteration_range),
+        "clip": list(bundle.clip) if bundle.clip is not None else None,
+        "feature_names": bundle.feature_names,
+        "n_features": len(bundle.scale),
+        "n_classes": len(bundle.classes),
+        "xgboost_version": xgb.__version__,
+        "tree_max_depth": bundle.trees.max_depth if bundle.trees is not None else None,
+    }
+    arrays = {
+        "manifest": np.frombuffer(json.dumps(manifest).encode("utf-8"), dtype=np.uint8),
+        "booster": np.frombuffer(bundle.booster.save_raw(raw_format="ubj"), dtype=np.uint8),
+        "scale": bundle.scale,
+        "offset": bundle.offset,
+        "classes": bundle.classes,
+    }
+    if bundle.trees is not None:
+        arrays.update(
+            {f"tree_{name}": array for name, array in bundle.trees.arrays().items()}
+        )
+    # Written next to the destination and renamed over it, so a server polling the model
+    # directory never reads a half-written bundle.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def read_bundle(path):
+    with np.load(path, allow_pickle=False) as arrays:
+        manifest = json.loads(arrays["manifest"].tobytes().decode("utf-8"))
+        if manifest.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"{path} is not a model bundle")
+        if manifest["version"] > BUNDLE_VERSION:
+            raise ValueError(
+                f"{path} is bundle version {manifest['version']}; this server reads up to "
+                f"version {BUNDLE_VERSION}"
+            )
+        booster = xgb.Booster()
+        booster.load_model(bytearray(arrays["booster"].tobytes()))
+        iteration_range = tuple(manifest["iteration_range"])
+        if "tree_max_depth" not in manifest:
+            # Written before bundles carried the tree arrays.
+            trees = TreeEnsemble.from_booster(booster, iteration_range)
+        elif manifest["tree_max_depth"] is not None:
+            trees = TreeEnsemble(
+                **{name: arrays[f"tree_{name}"] for name in ARRAY_FIELDS},
+                max_depth=manifest["tree_max_depth"],
+            )
+        else:
+            trees = None
+        return ModelBundle(
+            booster=booster,
+            objective=manifest["objective"],
+            scale=arrays["scale"],
+            offset=arrays["offset"],
+            clip=tuple(manifest["clip"]) if manifest["clip"] is not None else None,
+            classes=arrays["classes"],
+            feature_names=manifest["feature_names"],
+            iteration_range=iteration_range,
+            trees=trees,
+            manifest=manifest,
+        )
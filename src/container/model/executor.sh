@@ -3,7 +3,12 @@
 if [ $1 = "train" ]; then
     python ./train.py
 elif [ $1 = "serve" ]; then
-    python ./serve.py
+    # exec, so the container's SIGTERM reaches serve.py and it can stop nginx and gunicorn
+    exec python ./serve.py
+elif [ $1 = "batch" ]; then
+    # executor.sh batch <input> <output> [options]; see batch_score.py
+    shift
+    exec python ./batch_score.py "$@"
 elif [ $1 = "debug" ]; then 
     /bin/bash
 else
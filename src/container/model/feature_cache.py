@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import sklearn
+
+
+# Bump when the layout or the preprocessing behind the cached arrays changes, so older entries
+# stop matching.
+CACHE_FORMAT_VERSION = 1
+
+FEATURES_FILE = "features.npy"
+TARGETS_FILE = "targets.npy"
+SCALER_FILE = "scaler.joblib"
+LABEL_ENCODER_FILE = "label_encoder.joblib"
+MANIFEST_FILE = "manifest.json"
+
+
+def fingerprint_files(files, **settings):
+    """Hash the contents of the training files together with the settings that shape the
+    preprocessed output, so any change to either gives a new fingerprint."""
+    digest = hashlib.sha256()
+    digest.update(
+        json.dumps(
+            dict(
+                settings,
+                cache_format_version=CACHE_FORMAT_VERSION,
+                sklearn_version=sklearn.__version__,
+            ),
+            sort_keys=True,
+        ).encode("utf-8")
+    )
+    for fname in files:
+        digest.update(os.path.basename(fname).encode("utf-8") + b"\0")
+        with open(fname, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """Scaled features, encoded labels and the fitted scaler/encoder for one dataset fingerprint.
+
+    Arrays are stored as .npy files and loaded memory-mapped. An entry is written to a temporary
+    directory and renamed into place, so a job that dies part way never leaves a half-written
+    entry behind.
+    """
+
+    def __init__(self, cache_dir, fingerprint):
+        self.cache_dir = cache_dir
+        self.fingerprint = fingerprint
+        self.path = os.path.join(cache_dir, fingerprint)
+        self._staging = None
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, MANIFEST_FILE))
+
+    def load(self):
+        start = time.perf_counter()
+        features = np.load(os.path.join(self.path, FEATURES_FILE), mmap_mode="r")
+        targets = np.load(os.path.join(self.path, TARGETS_FILE), mmap_mode="r")
+        scaler = joblib.load(os.path.join(self.path, SCALER_FILE))
+        label_encoder = joblib.load(os.path.join(self.path, LABEL_ENCODER_FILE))
+        logging.info(
+            f"Feature cache hit for {self.fingerprint[:12]}: {features.shape[0]} rows, "
+            f"{self._size_mb():.1f} MB, loaded in {time.perf_counter() - start:.3f}s."
+        )
+        return features, targets, scaler, label_encoder
+
+    def open_arrays(self, n_rows, n_features, dtype=np.float32):
+        """Create writable memory-mapped arrays for a new entry, to be filled in and then
+        committed with finish()."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._staging = tempfile.mkdtemp(dir=self.cache_dir, prefix=".staging-")
+        self._start = time.perf_counter()
+        features = np.lib.format.open_memmap(
+            os.path.join(self._staging, FEATURES_FILE),
+            mode="w+",
+            dtype=dtype,
+            shape=(n_rows, n_features),
+        )
+        targets = np.lib.format.open_memmap(
+            os.path.join(self._staging, TARGETS_FILE),
+            mode="w+",
+            dtype=np.int32,
+            shape=(n_rows,),
+        )
+        return features, targets
+
+    def finish(self, features, targets, scaler, label_encoder):
+        features.flush()
+        targets.flush()
+        joblib.dump(scaler, os.path.join(self._staging, SCALER_FILE))
+        joblib.dump(label_encoder, os.path.join(self._staging, LABEL_ENCODER_FILE))
+        with open(os.path.join(self._staging, MANIFEST_FILE), "w") as f:
+            json.dump(
+                {
+                    "fingerprint": self.fingerprint,
+                    "rows": int(features.shape[0]),
+                    "features": int(features.shape[1]),
+                    "feature_dtype": str(features.dtype),
+                },
+                f,
+            )
+        try:
+            os.rename(self._staging, self.path)
+        except OSError:
+            # Another job stored the same entry first; keep theirs.
+            shutil.rmtree(self._staging, ignore_errors=True)
+        self._staging = None
+        logging.info(
+            f"Stored feature cache entry {self.fingerprint[:12]}: {features.shape[0]} rows, "
+            f"{self._size_mb():.1f} MB, in {time.perf_counter() - self._start:.3f}s."
+        )
+
+    def save(self, features, targets, scaler, label_encoder, dtype=np.float32):
+        cached_features, cached_targets = self.open_arrays(*features.shape, dtype=dtype)
+        cached_features[:] = features
+        cached_targets[:] = targets
+        self.finish(cached_features, cached_targets, scaler, label_encoder)
+
+    def _size_mb(self):
+        return (
+            sum(
+                os.path.getsize(os.path.join(self.path, name))
+                for name in os.listdir(self.path)
+            )
+            / 1e6
+        )
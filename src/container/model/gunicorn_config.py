@@ -0,0 +1,41 @@
+# Gunicorn settings that can't be given on the command line (serve.py passes this file with -c).
+
+import os
+
+
+CPU_AFFINITY = os.environ.get("MODEL_SERVER_CPU_AFFINITY", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+THREADS = int(os.environ.get("MODEL_SERVER_THREADS") or 1)
+
+
+def pre_fork(server, worker):
+    # Runs in the master. Give the new worker the lowest slot no live worker holds, so a
+    # worker that replaces a dead one takes over its cores rather than doubling up on others'.
+    if not CPU_AFFINITY or not hasattr(os, "sched_setaffinity"):
+        return
+    taken = {getattr(w, "cpu_slot", None) for w in server.WORKERS.values()}
+    worker.cpu_slot = next(slot for slot in range(len(taken) + 1) if slot not in taken)
+    cores = sorted(os.sched_getaffinity(0))
+    worker.cpus = {
+        cores[(worker.cpu_slot * THREADS + i) % len(cores)] for i in range(THREADS)
+    }
+
+
+def post_fork(server, worker):
+    cpus = getattr(worker, "cpus", None)
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+        server.log.info(f"Worker {worker.pid} pinned to CPUs {sorted(cpus)}.")
+
+
+def post_worker_init(worker):
+    # Runs in each worker after it has imported wsgi:app and before it accepts connections, so
+    # no request (and no /ping) reaches a worker whose model isn't loaded and warm yet. With
+    # --preload the model was already read in the master; this only runs the warm-up batches.
+    # A failed warm-up is logged and retried by /ping rather than killing the worker.
+    import inference
+
+    inference.warm_up()
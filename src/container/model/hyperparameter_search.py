@@ -0,0 +1,177 @@
+import concurrent.futures
+import logging
+import math
+import os
+import time
+
+import numpy as np
+import xgboost as xgb
+
+
+# Filled in each pool process by _init_worker, so the data is sent to a worker once rather
+# than with every trial.
+_worker_data = None
+
+
+def split_search_space(hyperparams):
+    """Separate ranged hyperparameters from fixed ones. A list is a set of choices; a dict
+    with "min" and "max" (and optionally "log": true) is a range, of integers if both bounds
+    are integers."""
+    space, fixed = {}, {}
+    for key, value in hyperparams.items():
+        if isinstance(value, list) or (
+            isinstance(value, dict) and {"min", "max"} <= value.keys()
+        ):
+            space[key] = value
+        else:
+            fixed[key] = value
+    return space, fixed
+
+
+def sample(space, rng):
+    values = {}
+    for key, spec in space.items():
+        if isinstance(spec, list):
+            values[key] = spec[rng.integers(len(spec))]
+        elif isinstance(spec["min"], int) and isinstance(spec["max"], int):
+            values[key] = int(rng.integers(spec["min"], spec["max"] + 1))
+        elif spec.get("log"):
+            values[key] = float(
+                math.exp(rng.uniform(math.log(spec["min"]), math.log(spec["max"])))
+            )
+        else:
+            values[key] = float(rng.uniform(spec["min"], spec["max"]))
+    return values
+
+
+def successive_halving(
+    features,
+    targets,
+    valid_features,
+    valid_targets,
+    trials,
+    max_rounds,
+    eta=3,
+    early_stopping_rounds=10,
+    workers=None,
+):
+    """Run `trials` (a list of (hyperparameters, native params) pairs) in rungs of growing
+    boosting budgets, keeping the best 1/eta of the trials after each rung.
+
+    Every trial boosts until `max_rounds` at most and stops early once its validation loss
+    hasn't improved for `early_stopping_rounds` rounds; a trial that stopped early isn't
+    trained any further if promoted. Trials continue from their own booster in the next rung
+    instead of starting over, and are ranked on their best round over all rungs. Returns one
+    log entry per trial and rung.
+    """
+    cores = os.cpu_count() or 1
+    workers = min(workers or cores, len(trials))
+    nthread = max(1, cores // workers)
+    n_rungs = int(math.log(len(trials), eta) + 1e-9) + 1
+    min_rounds = max(1, max_rounds // eta ** (n_rungs - 1))
+    logging.info(
+        f"Searching {len(trials)} trials in {n_rungs} rung(s) on {workers} process(es) "
+        f"with {nthread} thread(s) each."
+    )
+
+    state = {
+        trial_id: {"params": dict(params, nthread=nthread), "booster": None, "history": []}
+        for trial_id, (_, params) in enumerate(trials)
+    }
+    active = list(state)
+    log = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(features, targets, valid_features, valid_targets),
+    ) as pool:
+        for rung in range(n_rungs):
+            rounds = min(max_rounds, min_rounds * eta**rung)
+            # A trial that stopped early (or already has the rounds) has nothing to gain from
+            # more; it competes in later rungs with the result it has.
+            futures = {
+                trial_id: pool.submit(
+                    _run_trial,
+                    state[trial_id]["params"],
+                    rounds,
+                    state[trial_id]["booster"],
+                    state[trial_id]["history"],
+                    early_stopping_rounds,
+                )
+                for trial_id in active
+                if _needs_rounds(state[trial_id].get("result"), rounds)
+            }
+            for trial_id, future in futures.items():
+                result = future.result()
+                state[trial_id]["booster"] = result.pop("booster")
+                state[trial_id]["history"] = result.pop("history")
+                state[trial_id]["result"] = result
+                log.append(
+                    dict(
+                        result,
+                        trial=trial_id,
+                        rung=rung,
+                        hyperparameters=trials[trial_id][0],
+                    )
+                )
+            active.sort(key=lambda trial_id: state[trial_id]["result"]["validation_mlogloss"])
+            best = state[active[0]]["result"]
+            logging.info(
+                f"Rung {rung}: {len(active)} trial(s) at up to {rounds} rounds; best "
+                f"validation mlogloss {best['validation_mlogloss']:.5f}, "
+                f"merror {best['validation_merror']:.5f}."
+            )
+            if rung < n_rungs - 1:
+                active = active[: max(1, len(active) // eta)]
+
+    return active[0], log
+
+
+def _needs_rounds(result, rounds):
+    return result is None or (not result["stopped_early"] and result["rounds"] < rounds)
+
+
+def _init_worker(features, targets, valid_features, valid_targets):
+    global _worker_data
+    _worker_data = (
+        xgb.DMatrix(features, label=targets),
+        xgb.DMatrix(valid_features, label=valid_targets),
+        np.asarray(valid_targets),
+    )
+
+
+def _run_trial(params, rounds, booster_raw, history, early_stopping_rounds):
+    dtrain, dvalid, valid_targets = _worker_data
+    start = time.perf_counter()
+    booster = None
+    if booster_raw is not None:
+        booster = xgb.Booster(params)
+        booster.load_model(bytearray(booster_raw))
+    done = booster.num_boosted_rounds() if booster is not None else 0
+    evals_result = {}
+    booster = xgb.train(
+        dict(params, eval_metric=["merror", "mlogloss"]),
+        dtrain,
+        num_boost_round=rounds - done,
+        xgb_model=booster,
+        evals=[(dvalid, "validation")],
+        early_stopping_rounds=early_stopping_rounds,
+        evals_result=evals_result,
+        verbose_eval=False,
+    )
+    # The best round is taken from the validation loss of every round so far rather than from
+    # XGBoost's early stopping, which only knows about the rounds since this rung's resume.
+    history = list(history) + evals_result["validation"]["mlogloss"]
+    best_iteration = int(np.argmin(history))
+    probabilities = booster.predict(dvalid, iteration_range=(0, best_iteration + 1))
+    return {
+        "booster": booster.save_raw(),
+        "history": history,
+        "rounds": booster.num_boosted_rounds(),
+        "best_iteration": best_iteration,
+        "stopped_early": booster.num_boosted_rounds() < rounds
+        or len(history) - 1 - best_iteration >= early_stopping_rounds,
+        "validation_mlogloss": float(history[best_iteration]),
+        "validation_merror": float(np.mean(probabilities.argmax(axis=1) != valid_targets)),
+        "seconds": time.perf_counter() - start,
+    }
@@ -1,19 +1,256 @@
-import joblib
-import pandas as pd
+import logging
 import os
+import threading
+import time
+
+import numpy as np
+
+import metrics
+import serialization
+from batcher import MicroBatcher
+from bundle import BUNDLE_NAME, ModelBundle, read_bundle
+from model_cache import ModelCache
+from prediction_cache import PredictionCache
+from predictor import CompiledPredictor
+
+
+MODEL_DIR = os.environ.get("MODEL_DIR", "/opt/ml/model")
+MODEL_RELOAD_INTERVAL = float(os.environ.get("MODEL_RELOAD_INTERVAL", 5))
+BATCH_WAIT_MS = float(os.environ.get("MODEL_SERVER_BATCH_WAIT_MS", 0))
+BATCH_MAX_ROWS = int(os.environ.get("MODEL_SERVER_BATCH_MAX_ROWS", 256))
+PREDICTION_CACHE_SIZE = int(os.environ.get("MODEL_SERVER_PREDICTION_CACHE_SIZE", 0))
+PREDICTION_CACHE_TTL = float(os.environ.get("MODEL_SERVER_PREDICTION_CACHE_TTL", 0))
+TREE_ENGINE = os.environ.get("MODEL_SERVER_TREE_ENGINE", "auto")
+# XGBoost threads per prediction; serve.py sets it to this worker's share of the cores. 0
+# leaves XGBoost's default (every core).
+THREADS = int(os.environ.get("MODEL_SERVER_THREADS") or 0)
+# Multi-model mode: every directory under MODELS_DIR holds one model's artifacts, and requests
+# name the one they want. Each worker keeps the most recently used ones loaded, up to about
+# MODEL_CACHE_MB of artifacts.
+MODELS_DIR = os.environ.get("MODEL_SERVER_MODELS_DIR", "")
+MODEL_CACHE_MB = float(os.environ.get("MODEL_SERVER_MODEL_CACHE_MB", 512))
+
+ARTIFACT_NAMES = ("model.joblib", "scaler.joblib", "label_encoder.joblib")
+
+
+class ModelRegistry:
+    """Loads the model artifacts once per worker and keeps them in memory.
+
+    The artifacts are the model.bundle file train.py writes or, for models trained before
+    it did, the three joblib files. They are stat'ed at most once every `reload_interval`
+    seconds; if any of them changed on disk, they are re-read and swapped in together. If that
+    fails (e.g. an artifact is still being written), the loaded model keeps serving and the
+    reload is tried again at the next check.
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, reload_interval=MODEL_RELOAD_INTERVAL):
+        self.model_dir = model_dir
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._loaded = None
+        self._signature = None
+        self._last_check = 0.0
+        # Incremented every time a new set of artifacts is swapped in.
+        self.version = 0
+        # On-disk size of the loaded artifacts.
+        self.artifact_bytes = 0
+        self.stats = {
+            "hits": 0,
+            "reloads": 0,
+            "reload_failures": 0,
+            "load_time_seconds": 0.0,
+            "last_load_time_seconds": 0.0,
+        }
+
+    def get(self):
+        return self._current()[0]
+
+    def get_predictor(self):
+        return self._current()[1]
+
+    def _current(self):
+        loaded = self._loaded
+        if (
+            loaded is not None
+            and time.monotonic() - self._last_check < self.reload_interval
+        ):
+            self.stats["hits"] += 1
+            return loaded
+
+        with self._lock:
+            self._last_check = time.monotonic()
+            if self._loaded is None:
+                self._load(self._artifact_signature())
+                return self._loaded
+            try:
+                signature = self._artifact_signature()
+                if signature != self._signature:
+                    self._load(signature)
+                else:
+                    self.stats["hits"] += 1
+            except Exception as e:
+                self.stats["reload_failures"] += 1
+                logging.error(
+                    f"Couldn't reload the model artifacts from {self.model_dir}; still serving "
+                    f"the loaded ones: {e!r}"
+                )
+            return self._loaded
+
+    def _artifact_signature(self):
+        signature = []
+        for path in artifact_paths(self.model_dir):
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size, stat.st_ino))
+        return tuple(signature)
+
+    def _load(self, signature):
+        start = time.perf_counter()
+        bundle = load_bundle(self.model_dir)
+        predictor = CompiledPredictor(bundle, tree_engine=TREE_ENGINE, nthread=THREADS)
+        elapsed = time.perf_counter() - start
+
+        # Swap the whole tuple in one assignment so readers never see a mix of
+        # old and new artifacts.
+        self._loaded = (bundle, predictor)
+        self._signature = signature
+        self.artifact_bytes = sum(size for _, _, size, _ in signature)
+        self.version += 1
+        self.stats["reloads"] += 1
+        self.stats["load_time_seconds"] += elapsed
+        self.stats["last_load_time_seconds"] = elapsed
+        metrics.observe("model_load", elapsed)
+        logging.info(f"Loaded model artifacts from {self.model_dir} in {elapsed:.3f}s")
+
+
+registry = ModelRegistry()
+models = (
+    ModelCache(MODELS_DIR, int(MODEL_CACHE_MB * (1 << 20)), ModelRegistry)
+    if MODELS_DIR
+    else None
+)
+
+
+def _predict_now(features):
+    return registry.get_predictor().predict(features)
+
+
+batcher = MicroBatcher(_predict_now, BATCH_MAX_ROWS, BATCH_WAIT_MS / 1000)
+prediction_cache = (
+    PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL)
+    if PREDICTION_CACHE_SIZE > 0
+    else None
+)
+
+metrics.register_stats("model_registry", registry.stats)
+metrics.register_stats("batcher", batcher.stats)
+if prediction_cache is not None:
+    metrics.register_stats("prediction_cache", prediction_cache.stats)
+if models is not None:
+    metrics.register_stats("model_cache", models.stats)
 
 
 def predict(df):
-    model, scaler, label_encoder = load_model()
-    scaled = scaler.transform(df)
-    predictions = model.predict(scaled)
-    return pd.DataFrame(label_encoder.inverse_transform(predictions))
-
-
-def load_model():
-    print(f"Working dir right before loading model: {os.getcwd()}")
-    print(f"Contents of working dir: {os.listdir()}")
-    model = joblib.load("/opt/ml/model/model.joblib")
-    scaler = joblib.load("/opt/ml/model/scaler.joblib")
-    label_encoder = joblib.load("/opt/ml/model/label_encoder.joblib")
+    # Only this DataFrame entry point needs pandas; the serving path never imports it itself.
+    import pandas as pd
+
+    predictor = registry.get_predictor()
+    if predictor.feature_names is not None:
+        df = df[predictor.feature_names]
+    return pd.DataFrame(predictor.predict(df.to_numpy(dtype=np.float64)))
+
+
+def get_model(name):
+    """The ModelRegistry of model `name` in multi-model mode (see ModelCache.get)."""
+    return models.get(name)
+
+
+def predict_features(features, model=None):
+    """Predict `features` with the single model or, in multi-model mode, with `model`, a
+    registry from get_model."""
+    if model is not None:
+        # Multi-model requests go straight to their model: batching or caching across models
+        # would only mix unrelated requests.
+        name = os.path.basename(model.model_dir)
+        start = time.perf_counter()
+        result = model.get_predictor().predict(features)
+        metrics.increment_model(name, "predicted_rows", len(result))
+        metrics.increment_model(name, "predict_seconds", time.perf_counter() - start)
+        return result
+
+    if prediction_cache is None:
+        return batcher.predict(features)
+
+    # Make sure any pending artifact reload has happened before reading the version the
+    # cached labels will be filed under.
+    registry.get_predictor()
+    return prediction_cache.predict(features, batcher.predict, registry.version)
+
+
+def feature_names(model=None):
+    predictor = (model or registry).get_predictor()
+    return predictor.feature_names or serialization.FEATURE_NAMES
+
+
+def load_model(model=None):
+    """The fitted (model, scaler, label_encoder) from the model directory's joblib files, as
+    this function has always returned; the server itself predicts from current_bundle()."""
+    return read_artifacts((model or registry).model_dir)
+
+
+def current_bundle(model=None):
+    """The ModelBundle the server is predicting with, loading it if needed."""
+    return (model or registry).get()
+
+
+_warm = threading.Event()
+
+
+def warm_up():
+    """Load the model and run synthetic batches through it, so the first real request pays
+    for neither. Returns whether the model is ready to serve; a failure (e.g. no model in
+    MODEL_DIR yet) is logged and left for the next ready() call to retry.
+
+    In multi-model mode there is nothing to warm up front: models are loaded on first use."""
+    if models is not None:
+        _warm.set()
+        return True
+    start = time.perf_counter()
+    try:
+        predictor = registry.get_predictor()
+        # One row and a full micro-batch cover both sides of the tree engine's batch limit.
+        for n_rows in sorted({1, max(1, BATCH_MAX_ROWS)}):
+            predictor.predict(np.zeros((n_rows, predictor.n_features)))
+    except Exception as e:
+        logging.warning(f"Couldn't load the model from {registry.model_dir}: {e!r}")
+        return False
+    _warm.set()
+    logging.info(f"Model warmed up in {time.perf_counter() - start:.3f}s")
+    return True
+
+
+def ready():
+    return _warm.is_set() or warm_up()
+
+
+def artifact_paths(model_dir):
+    bundle_path = os.path.join(model_dir, BUNDLE_NAME)
+    if os.path.exists(bundle_path):
+        return (bundle_path,)
+    return tuple(os.path.join(model_dir, name) for name in ARTIFACT_NAMES)
+
+
+def load_bundle(model_dir):
+    paths = artifact_paths(model_dir)
+    if len(paths) == 1:
+        return read_bundle(paths[0])
+    return ModelBundle.from_artifacts(*read_artifacts(model_dir))
+
+
+def read_artifacts(model_dir):
+    # Only models without a bundle need joblib (and, through unpickling, sklearn).
+    import joblib
+
+    model = joblib.load(os.path.join(model_dir, "model.joblib"))
+    scaler = joblib.load(os.path.join(model_dir, "scaler.joblib"))
+    label_encoder = joblib.load(os.path.join(model_dir, "label_encoder.joblib"))
     return model, scaler, label_encoder
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+# Feeds training files to train.py through named pipes, the way SageMaker does in Pipe mode, so
+# that the Pipe mode input path can be exercised locally.
+#
+# SageMaker presents a Pipe mode channel as a series of FIFOs, <channel dir>_0, <channel dir>_1,
+# ..., with the channel's objects written back to back into each; the training code opens the
+# next FIFO every time it makes another pass over the data. This script creates those FIFOs one
+# after the other and writes the given files into each, until it is stopped.
+#
+# Usage (start this first, in one shell or in the background):
+#   python local_pipe.py /opt/ml/input/data/train /opt/ml/input/data/train/iris.csv
+# and then:
+#   TRAINING_INPUT_MODE=Pipe python train.py
+
+import argparse
+import glob
+import os
+import signal
+import sys
+
+
+def feed(fifo_prefix, files, max_passes=None):
+    # Pipes left over from an earlier run would otherwise be picked up by the next train.py.
+    for stale in glob.glob(f"{fifo_prefix}_[0-9]*"):
+        os.remove(stale)
+
+    passes = 0
+    while max_passes is None or passes < max_passes:
+        fifo_path = f"{fifo_prefix}_{passes}"
+        os.mkfifo(fifo_path)
+
+        # Opening for writing blocks until train.py opens the pipe for reading.
+        with open(fifo_path, "wb") as fifo:
+            for fname in files:
+                with open(fname, "rb") as f:
+                    data = f.read()
+                if not data.endswith(b"\n"):
+                    data += b"\n"
+                fifo.write(data)
+        print(f"Finished pass {passes} through {fifo_path}", file=sys.stderr)
+        passes += 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fifo_prefix", help="the channel directory, e.g. /opt/ml/input/data/train")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--max-passes", type=int)
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    feed(args.fifo_prefix.rstrip("/"), args.files, args.max_passes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import bisect
+import glob
+import mmap
+import os
+import time
+
+import numpy as np
+
+
+# Every worker keeps its metrics in a small memory-mapped file in this directory, so that
+# whichever worker answers /metrics can add up the numbers of all of them. serve.py empties it
+# on startup; files left by workers that have since exited keep counting towards the totals,
+# which keeps the exported counters monotonic across worker restarts.
+METRICS_DIR = os.environ.get("MODEL_SERVER_METRICS_DIR", "/tmp/model_server_metrics")
+
+STAGES = ("model_load", "parse", "scale", "predict", "serialize")
+BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Counters, with their help text. Counters fed from the `stats` dicts of the registry, cache and
+# batcher are named "<component>_<key>" and copied over by sync_stats() from the dicts given
+# to register_stats().
+RESPONSE_CLASSES = ("2xx", "3xx", "4xx", "5xx")
+COUNTERS = {
+    "predicted_rows": "Rows predicted by /invocations.",
+    "model_registry_hits": "Model lookups served from memory.",
+    "model_registry_reloads": "Times the model artifacts were (re)loaded.",
+    "model_registry_reload_failures": "Reloads that failed, leaving the previous model in use.",
+    "prediction_cache_hits": "Rows answered from the prediction cache.",
+    "prediction_cache_misses": "Rows not found in the prediction cache.",
+    "prediction_cache_evictions": "Prediction cache entries evicted for space.",
+    "prediction_cache_expirations": "Prediction cache entries dropped after their TTL.",
+    "prediction_cache_invalidations": "Times the prediction cache was cleared for a new model.",
+    "batcher_requests": "Predict calls that went through the micro-batcher.",
+    "batcher_batches": "Predictor calls made by the micro-batcher.",
+    "batcher_rows": "Rows predicted by the micro-batcher.",
+    "model_cache_hits": "Multi-model lookups served from a worker's model cache.",
+    "model_cache_loads": "Models loaded into a worker's model cache.",
+    "model_cache_evictions": "Models evicted from a worker's model cache for space.",
+    "admission_rejected_requests": "Invocations turned away at the in-flight request limit.",
+    "admission_rejected_rows": "Invocations turned away at the in-flight row limit.",
+    "admission_expired": "Invocations dropped because their deadline passed before prediction.",
+}
+
+# Counters kept per model in multi-model mode, with their help text. Each worker keeps them in
+# one more small file per model it has served, "<pid>.<model>.model" in METRICS_DIR.
+MODEL_COUNTERS = {
+    "requests": "Invocations routed to the model.",
+    "predicted_rows": "Rows predicted by the model.",
+    "predict_seconds": "Time spent predicting with the model.",
+    "loads": "Times the model was loaded into a worker's model cache.",
+    "load_seconds": "Time spent loading the model.",
+    "evictions": "Times the model was evicted from a worker's model cache.",
+}
+
+# Slot layout of a worker's metrics file: per stage, one count per bucket plus +Inf, then the
+# sum and count of observations; after that, one slot per response class and per counter.
+_HISTOGRAM_WIDTH = len(BUCKETS) + 3
+_STAGE_OFFSETS = {stage: i * _HISTOGRAM_WIDTH for i, stage in enumerate(STAGES)}
+_COUNTER_OFFSETS = {
+    name: len(STAGES) * _HISTOGRAM_WIDTH + i
+    for i, name in enumerate(
+        [f"requests_{code}" for code in RESPONSE_CLASSES] + list(COUNTERS)
+    )
+}
+_N_SLOTS = len(STAGES) * _HISTOGRAM_WIDTH + len(_COUNTER_OFFSETS)
+_MODEL_OFFSETS = {name: i for i, name in enumerate(MODEL_COUNTERS)}
+
+_pid = None
+_values = None
+_shared = False
+_model_pid = None
+# model name -> (values, whether they are in a shared file)
+_model_values = {}
+_registered_stats = {}
+_stats_baselines = {}
+# What this worker's file held when it was opened (see _open_shared_values).
+_inherited = None
+
+
+def _worker_values():
+    # Re-open after a fork so each worker writes to its own file, not the one it inherited
+    # from a preloading master.
+    global _pid, _values, _shared, _inherited
+    pid = os.getpid()
+    if pid != _pid:
+        try:
+            path = os.path.join(METRICS_DIR, f"{pid}.metrics")
+            _values = _open_shared_values(path, _N_SLOTS)
+            _shared = True
+        except OSError:
+            # No usable shared directory; keep this worker's metrics in memory only.
+            _values = np.zeros(_N_SLOTS, dtype=np.float64)
+            _shared = False
+        _inherited = _values.copy()
+        _pid = pid
+    return _values
+
+
+def _open_shared_values(path, n_slots):
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    # A worker can get the pid of one that has exited. Its file is kept, and counted on from,
+    # so the totals never go backwards; it is only extended if it is too short.
+    with open(path, "ab") as f:
+        if os.fstat(f.fileno()).st_size < n_slots * 8:
+            f.truncate(n_slots * 8)
+    with open(path, "r+b") as f:
+        mapped = mmap.mmap(f.fileno(), n_slots * 8)
+    return np.frombuffer(mapped, dtype=np.float64)
+
+
+def _model_worker_values(model):
+    global _model_pid
+    pid = os.getpid()
+    if pid != _model_pid:
+        _model_values.clear()
+        _model_pid = pid
+    if model not in _model_values:
+        try:
+            path = os.path.join(METRICS_DIR, f"{pid}.{model}.model")
+            _model_values[model] = (_open_shared_values(path, len(MODEL_COUNTERS)), True)
+        except OSError:
+            _model_values[model] = (np.zeros(len(MODEL_COUNTERS), dtype=np.float64), False)
+    return _model_values[model][0]
+
+
+def observe(stage, seconds):
+    values = _worker_values()
+    offset = _STAGE_OFFSETS[stage]
+    values[offset + bisect.bisect_left(BUCKETS, seconds)] += 1
+    values[offset + len(BUCKETS) + 1] += seconds
+    values[offset + len(BUCKETS) + 2] += 1
+
+
+class timed:
+    """Context manager recording the duration of its block under `stage`."""
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.stage, time.perf_counter() - self.start)
+
+
+def increment(counter, amount=1):
+    _worker_values()[_COUNTER_OFFSETS[counter]] += amount
+
+
+def increment_model(model, counter, amount=1):
+    """Add to one of `model`'s MODEL_COUNTERS; `model` must be safe in a file name."""
+    _model_worker_values(model)[_MODEL_OFFSETS[counter]] += amount
+
+
+def count_response(status_code):
+    offset = _COUNTER_OFFSETS.get(f"requests_{status_code // 100}xx")
+    if offset is not None:
+        _worker_values()[offset] += 1
+
+
+def register_stats(component, stats):
+    _registered_stats[component] = stats
+
+
+def sync_stats():
+    values = _worker_values()
+    for component, stats in _registered_stats.items():
+        baseline = _stats_baselines.get(component, {})
+        for key, value in stats.items():
+            offset = _COUNTER_OFFSETS.get(f"{component}_{key}")
+            if offset is not None:
+                values[offset] = _inherited[offset] + value - baseline.get(key, 0)
+
+
+def _before_fork():
+    # A preloading master records what it has done so far (e.g. loading the model) in its own
+    # file, and each forked worker then only reports what it does on top of that.
+    if _registered_stats:
+        sync_stats()
+
+
+def _after_fork_in_child():
+    global _stats_baselines
+    _stats_baselines = {
+        component: dict(stats) for component, stats in _registered_stats.items()
+    }
+
+
+os.register_at_fork(before=_before_fork, after_in_child=_after_fork_in_child)
+
+
+def aggregate():
+    total = np.zeros(_N_SLOTS, dtype=np.float64)
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.metrics")):
+        values = np.fromfile(path, dtype=np.float64)
+        if values.shape == total.shape:
+            total += values
+    if _values is not None and not _shared:
+        total += _values
+    return total
+
+
+def aggregate_models():
+    totals = {}
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.model")):
+        # "<pid>.<model>.model"; model names may contain dots themselves.
+        model = os.path.basename(path).split(".", 1)[1][: -len(".model")]
+        values = np.fromfile(path, dtype=np.float64)
+        if values.shape == (len(MODEL_COUNTERS),):
+            totals[model] = totals.get(model, 0) + values
+    if _model_pid == os.getpid():
+        for model, (values, shared) in _model_values.items():
+            if not shared:
+                totals[model] = totals.get(model, 0) + values
+    return totals
+
+
+def render_prometheus():
+    total = aggregate()
+    lines = [
+        "# HELP model_server_stage_duration_seconds Time spent in each serving stage.",
+        "# TYPE model_server_stage_duration_seconds histogram",
+    ]
+    for stage, offset in _STAGE_OFFSETS.items():
+        cumulative = 0
+        for i, bound in enumerate(BUCKETS + (float("inf"),)):
+            cumulative += total[offset + i]
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(
+                f'model_server_stage_duration_seconds_bucket{{stage="{stage}",le="{le}"}} '
+                f"{cumulative:.0f}"
+            )
+        lines.append(
+            f'model_server_stage_duration_seconds_sum{{stage="{stage}"}} '
+            f"{float(total[offset + len(BUCKETS) + 1])!r}"
+        )
+        lines.append(
+            f'model_server_stage_duration_seconds_count{{stage="{stage}"}} '
+            f"{total[offset + len(BUCKETS) + 2]:.0f}"
+        )
+
+    lines.append("# HELP model_server_requests_total Invocations answered, by status class.")
+    lines.append("# TYPE model_server_requests_total counter")
+    for code in RESPONSE_CLASSES:
+        lines.append(
+            f'model_server_requests_total{{code="{code}"}} '
+            f"{total[_COUNTER_OFFSETS[f'requests_{code}']]:.0f}"
+        )
+
+    for name, help_text in COUNTERS.items():
+        lines.append(f"# HELP model_server_{name}_total {help_text}")
+        lines.append(f"# TYPE model_server_{name}_total counter")
+        lines.append(f"model_server_{name}_total {total[_COUNTER_OFFSETS[name]]:.0f}")
+
+    model_totals = aggregate_models()
+    if model_totals:
+        for name, help_text in MODEL_COUNTERS.items():
+            lines.append(f"# HELP model_server_model_{name}_total {help_text}")
+            lines.append(f"# TYPE model_server_model_{name}_total counter")
+            for model, values in sorted(model_totals.items()):
+                value = values[_MODEL_OFFSETS[name]]
+                lines.append(
+                    f'model_server_model_{name}_total{{model="{model}"}} '
+                    + (f"{float(value)!r}" if name.endswith("_seconds") else f"{value:.0f}")
+                )
+
+    return "\n".join(lines) + "\n"
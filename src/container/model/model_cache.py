@@ -0,0 +1,109 @@
+import collections
+import logging
+import os
+import re
+import threading
+import time
+
+import metrics
+
+
+# Names of the model directories under the models root. They end up in file names and metric
+# labels, so nothing else is accepted.
+MODEL_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+
+class ModelNotFound(LookupError):
+    pass
+
+
+def model_name(target):
+    """The model directory name for a target-model header value. SageMaker-style targets name
+    an archive (e.g. "model-a.tar.gz"), which the models root holds extracted."""
+    if target.endswith(".tar.gz"):
+        target = target[: -len(".tar.gz")]
+    if not MODEL_NAME.match(target):
+        raise ModelNotFound(f"Invalid model name '{target}'")
+    return target
+
+
+class ModelCache:
+    """Per-worker LRU of the models under `models_dir`, each loaded on first use.
+
+    A model is a directory of artifacts, as /opt/ml/model is in single-model mode, and is
+    held as the ModelRegistry that `make_registry(model_dir)` returns (so it is still reloaded
+    when its artifacts change). Least recently used models are evicted once the artifacts of
+    the loaded ones add up to more than `max_bytes`, which stands in for the memory they take;
+    the model just loaded is never evicted. Concurrent requests for a model that isn't loaded
+    yet wait for a single load.
+    """
+
+    def __init__(self, models_dir, max_bytes, make_registry):
+        self.models_dir = models_dir
+        self.max_bytes = max_bytes
+        self.make_registry = make_registry
+        self._lock = threading.Lock()
+        self._registries = collections.OrderedDict()
+        self._loading = {}
+        self._sizes = {}
+        self.loaded_bytes = 0
+        self.stats = {"hits": 0, "loads": 0, "evictions": 0}
+
+    def get(self, name):
+        """The ModelRegistry of model `name`, loading it if needed. Raises ModelNotFound if
+        there is no such model directory."""
+        name = model_name(name)
+        with self._lock:
+            registry = self._hit(name)
+            if registry is not None:
+                return registry
+            load_lock = self._loading.setdefault(name, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                # Loaded by a concurrent request while this one waited.
+                registry = self._hit(name)
+                if registry is not None:
+                    return registry
+            model_dir = os.path.join(self.models_dir, name)
+            try:
+                if not os.path.isdir(model_dir):
+                    raise ModelNotFound(f"No model named '{name}'")
+                start = time.perf_counter()
+                registry = self.make_registry(model_dir)
+                registry.get_predictor()
+                elapsed = time.perf_counter() - start
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(name, None)
+                raise
+
+            with self._lock:
+                self._loading.pop(name, None)
+                self._registries[name] = registry
+                self._sizes[name] = registry.artifact_bytes
+                self.loaded_bytes += registry.artifact_bytes
+                self.stats["loads"] += 1
+                self._evict(keep=name)
+        metrics.increment_model(name, "loads")
+        metrics.increment_model(name, "load_seconds", elapsed)
+        return registry
+
+    def _hit(self, name):
+        registry = self._registries.get(name)
+        if registry is not None:
+            self._registries.move_to_end(name)
+            self.stats["hits"] += 1
+        return registry
+
+    def _evict(self, keep):
+        while self.loaded_bytes > self.max_bytes and len(self._registries) > 1:
+            name = next(iter(self._registries))
+            if name == keep:
+                self._registries.move_to_end(name)
+                continue
+            del self._registries[name]
+            self.loaded_bytes -= self._sizes.pop(name)
+            self.stats["evictions"] += 1
+            metrics.increment_model(name, "evictions")
+            logging.info(f"Evicted model '{name}' from the model cache.")
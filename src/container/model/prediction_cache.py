@@ -0,0 +1,82 @@
+import collections
+import threading
+import time
+
+import numpy as np
+
+
+class PredictionCache:
+    """Bounded LRU cache of predicted labels keyed on the raw bytes of each feature row.
+
+    Entries belong to one model version at a time: the first lookup made with a new version
+    empties the cache, so labels predicted by a previous model are never served. With a
+    `ttl_seconds` above zero, entries older than that are treated as misses and dropped.
+    """
+
+    def __init__(self, max_entries, ttl_seconds=0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._version = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def predict(self, features, predict_fn, version):
+        """Return labels for `features`, sending only the rows not in the cache to
+        `predict_fn`."""
+        # Adding 0.0 folds -0.0 into 0.0 so equal rows always produce the same key.
+        rows = np.ascontiguousarray(features, dtype=np.float64) + 0.0
+        keys = [row.tobytes() for row in rows]
+        now = time.monotonic()
+
+        labels = [None] * len(keys)
+        missing = []
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    self.stats["invalidations"] += 1
+                self._entries.clear()
+                self._version = version
+
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None and self.ttl_seconds and entry[1] <= now:
+                    del self._entries[key]
+                    self.stats["expirations"] += 1
+                    entry = None
+                if entry is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    labels[i] = entry[0]
+            self.stats["hits"] += len(keys) - len(missing)
+            self.stats["misses"] += len(missing)
+
+        if not missing:
+            return np.asarray(labels)
+
+        predicted = predict_fn(rows[missing])
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            # Don't store labels if another request moved the cache on to a newer model
+            # while these were being predicted.
+            store = version == self._version
+            for i, label in zip(missing, predicted):
+                labels[i] = label
+                if store:
+                    self._entries[keys[i]] = (label, expires_at)
+                    self._entries.move_to_end(keys[i])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+        return np.asarray(labels)
@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+import metrics
+from bundle import ModelBundle
+from tree_engine import fastest_batch_limit
+
+# Batch sizes tried when deciding up to which size the NumPy tree engine is faster.
+TREE_ENGINE_BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class CompiledPredictor:
+    """Fused scaler -> booster -> label decode path built once from the fitted artifacts.
+
+    Produces exactly the labels `label_encoder.inverse_transform(model.predict(scaler.transform(X)))`
+    would, without going through pandas or the sklearn wrappers on every call.
+
+    With `tree_engine` "auto", batches up to the size where the NumPy engine (see
+    tree_engine.py) was measured to beat XGBoost at load time are evaluated with it; "numpy"
+    uses it for every batch and "native" never does. "auto" only ever picks it after
+    checking that it predicts the same classes as XGBoost.
+
+    `nthread`, if set, caps the threads XGBoost predicts with.
+    """
+
+    @classmethod
+    def from_artifacts(cls, model, scaler, label_encoder, tree_engine="native", nthread=0):
+        return cls(
+            ModelBundle.from_artifacts(model, scaler, label_encoder), tree_engine, nthread
+        )
+
+    def __init__(self, bundle, tree_engine="native", nthread=0):
+        self.booster = bundle.booster
+        if nthread:
+            # Before the tree engine timings below, so XGBoost is measured as it will run.
+            self.booster.set_param("nthread", nthread)
+        self.objective = bundle.objective
+        self.feature_names = bundle.feature_names
+        self.n_features = len(bundle.scale)
+        self.classes = bundle.classes
+
+        # MinMaxScaler.transform is X * scale_ + min_ in float64, which XGBoost then casts to
+        # float32. Doing the same two steps (rather than folding the affine step into float32)
+        # keeps values that land exactly on a split threshold on the same side.
+        self.scale = bundle.scale
+        self.offset = bundle.offset
+        self.clip = bundle.clip
+        self.iteration_range = bundle.iteration_range
+
+        self.trees = bundle.trees
+        self.tree_engine_rows = 0
+        if self.trees is not None and tree_engine == "numpy":
+            self.tree_engine_rows = float("inf")
+        elif self.trees is not None and tree_engine == "auto":
+            self.tree_engine_rows = fastest_batch_limit(
+                self.trees, self._predict_native, self.n_features, TREE_ENGINE_BATCH_SIZES
+            )
+            logging.info(
+                f"NumPy tree engine selected for batches of up to {self.tree_engine_rows} rows."
+            )
+
+        self._lock = threading.Lock()
+        self._scaled = np.empty((0, self.n_features), dtype=np.float64)
+        self._input = np.empty((0, self.n_features), dtype=np.float32)
+
+    def predict(self, features):
+        return self.classes[self.predict_indices(features)]
+
+    def predict_indices(self, features):
+        # Numeric inputs of any width are read as they are (the scaling ufuncs upcast on the
+        # fly), so e.g. a float32 view over an .npy request body is never copied.
+        features = np.asarray(features)
+        if features.dtype.kind not in "biuf":
+            features = features.astype(np.float64)
+        if features.ndim != 2 or features.shape[1] != self.n_features:
+            raise ValueError(
+                f"Expected an (n, {self.n_features}) feature matrix, got shape {features.shape}"
+            )
+        n_rows = features.shape[0]
+        if n_rows == 0:
+            return np.empty(0, dtype=np.intp)
+
+        with self._lock:
+            if self._scaled.shape[0] < n_rows:
+                self._scaled = np.empty((n_rows, self.n_features), dtype=np.float64)
+                self._input = np.empty((n_rows, self.n_features), dtype=np.float32)
+            scaled = self._scaled[:n_rows]
+            inputs = self._input[:n_rows]
+
+            start = time.perf_counter()
+            np.multiply(features, self.scale, out=scaled)
+            np.add(scaled, self.offset, out=scaled)
+            if self.clip is not None:
+                np.clip(scaled, self.clip[0], self.clip[1], out=scaled)
+            inputs[...] = scaled
+            scaled_at = time.perf_counter()
+
+            if n_rows <= self.tree_engine_rows:
+                indices = self.trees.predict_indices(inputs)
+            else:
+                indices = self._predict_native(inputs)
+
+        metrics.observe("scale", scaled_at - start)
+        metrics.observe("predict", time.perf_counter() - scaled_at)
+        return indices
+
+    def _predict_native(self, inputs):
+        raw = self.booster.inplace_predict(inputs, iteration_range=self.iteration_range)
+        return self._to_class_indices(raw)
+
+    def _to_class_indices(self, raw):
+        if raw.ndim == 2:
+            return np.argmax(raw, axis=1)
+        if self.objective.startswith("multi:softmax"):
+            return raw.astype(np.intp)
+        return (raw > 0.5).astype(np.intp)
@@ -0,0 +1,339 @@
+import csv
+import io
+import json
+import math
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library parser.
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack requests are rejected with 415.
+    msgpack = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # Arrow requests are rejected with 415.
+    pa = None
+
+
+# Column order of the training data in data/train/iris.csv, minus the target.
+FEATURE_NAMES = ("sepal_length", "sepal_width", "petal_length", "petal_width")
+
+# Name of the single prediction column, matching the JSON Lines responses produced from
+# pd.DataFrame(predictions).to_json(orient="records", lines=True) before the codecs below.
+OUTPUT_COLUMN = "0"
+
+JSONLINES = "application/jsonlines"
+CSV = "text/csv"
+NPY = "application/x-npy"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+ARROW_FILE = "application/vnd.apache.arrow.file"
+MSGPACK = "application/x-msgpack"
+
+if orjson is not None:
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+else:
+    _loads = json.loads
+
+    def _dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+class PayloadError(ValueError):
+    pass
+
+
+##############
+## Decoders ##
+##############
+
+
+def decode_jsonlines(body, feature_names=FEATURE_NAMES, dtype=np.float64):
+    """Parse a JSON Lines body straight into an (n_records, n_features) matrix.
+
+    Values may be numbers or numeric strings. A missing or null feature becomes NaN, which
+    XGBoost treats as a missing value. Blank lines are skipped.
+    """
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    lines = [line for line in body.splitlines() if line.strip()]
+    return _decode_json_lines(lines, feature_names, dtype)
+
+
+def iter_jsonlines_chunks(lines, chunk_rows, feature_names=FEATURE_NAMES, dtype=np.float64):
+    """Decode an iterable of JSON Lines (e.g. a request stream) into matrices of `chunk_rows`
+    records each, so only one chunk of parsed records is alive at a time."""
+    chunk = []
+    first_line = 1
+    for line in lines:
+        if not line.strip():
+            continue
+        chunk.append(line)
+        if len(chunk) == chunk_rows:
+            yield _decode_json_lines(chunk, feature_names, dtype, first_line)
+            first_line += len(chunk)
+            chunk = []
+    if chunk:
+        yield _decode_json_lines(chunk, feature_names, dtype, first_line)
+
+
+def _decode_json_lines(lines, feature_names, dtype, first_line=1):
+    try:
+        records = [_loads(line) for line in lines]
+    except ValueError:
+        for i, line in enumerate(lines):
+            try:
+                _loads(line)
+            except ValueError as e:
+                raise PayloadError(
+                    f"Line {i + first_line} is not valid JSON: {e}"
+                ) from None
+        raise
+
+    return _records_to_matrix(records, feature_names, dtype, "Line", first_line)
+
+
+def decode_csv(body, feature_names=FEATURE_NAMES, dtype=np.float64):
+    """Parse a CSV body with one record per line; fields may be quoted.
+
+    Without a header the columns must be in the trained feature order; with a header
+    (detected by a non-numeric first field) columns are picked by name.
+    """
+    if isinstance(body, bytes):
+        try:
+            body = body.decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise PayloadError(f"The CSV body is not valid UTF-8: {e}") from None
+    # (line number, fields) of every non-blank record.
+    if '"' in body:
+        reader = csv.reader(io.StringIO(body))
+        try:
+            rows = [
+                (reader.line_num, fields)
+                for fields in reader
+                if len(fields) > 1 or (fields and fields[0].strip())
+            ]
+        except csv.Error as e:
+            raise PayloadError(f"Line {reader.line_num} is not valid CSV: {e}") from None
+    else:
+        # Nothing is quoted, so splitting on commas gives the same fields, faster.
+        rows = [
+            (i, line.split(","))
+            for i, line in enumerate(body.splitlines(), 1)
+            if line.strip()
+        ]
+
+    columns = list(range(len(feature_names)))
+    width = len(feature_names)
+    if rows and not _is_number(rows[0][1][0]):
+        header = [name.strip() for name in rows[0][1]]
+        missing = [name for name in feature_names if name not in header]
+        if missing:
+            raise PayloadError(f"CSV header is missing the columns {missing}")
+        columns = [header.index(name) for name in feature_names]
+        width = len(header)
+        rows = rows[1:]
+
+    features = np.empty((len(rows), len(feature_names)), dtype=dtype)
+    for i, (line, fields) in enumerate(rows):
+        if len(fields) != width:
+            raise PayloadError(f"Line {line} has {len(fields)} fields, expected {width}")
+        try:
+            features[i] = [
+                float(fields[j]) if fields[j].strip() else math.nan for j in columns
+            ]
+        except ValueError:
+            raise PayloadError(
+                f"Line {line} has a non-numeric value: {','.join(fields)!r}"
+            ) from None
+    return features
+
+
+def decode_npy(body, feature_names=FEATURE_NAMES, dtype=np.float64):
+    """View an .npy body as a feature matrix without copying it.
+
+    A 1-D array is treated as a single record. `dtype` is ignored: the predictor reads any
+    numeric dtype directly.
+    """
+    stream = io.BytesIO(body)
+    try:
+        version = np.lib.format.read_magic(stream)
+        if version == (1, 0):
+            shape, fortran_order, array_dtype = np.lib.format.read_array_header_1_0(
+                stream
+            )
+        else:
+            shape, fortran_order, array_dtype = np.lib.format.read_array_header_2_0(
+                stream
+            )
+    except ValueError as e:
+        raise PayloadError(f"Body is not a valid .npy array: {e}") from None
+
+    if array_dtype.kind not in "biuf":
+        raise PayloadError(f"Expected a numeric array, got dtype {array_dtype}")
+    count = int(np.prod(shape))
+    if len(body) - stream.tell() < count * array_dtype.itemsize:
+        raise PayloadError("Body is shorter than the .npy header declares")
+
+    features = np.frombuffer(body, dtype=array_dtype, count=count, offset=stream.tell())
+    features = features.reshape(shape, order="F" if fortran_order else "C")
+    if features.ndim == 1:
+        features = features.reshape(1, -1)
+    _check_shape(features, feature_names)
+    return features
+
+
+def decode_msgpack(body, feature_names=FEATURE_NAMES, dtype=np.float64):
+    """Parse a msgpack array of records (maps keyed by feature name) or of rows."""
+    try:
+        records = msgpack.unpackb(body)
+    except (ValueError, msgpack.ExtraData) as e:
+        raise PayloadError(f"Body is not valid msgpack: {e}") from None
+    if not isinstance(records, list):
+        raise PayloadError("Expected a msgpack array of records")
+
+    if records and isinstance(records[0], list):
+        try:
+            features = np.array(records, dtype=dtype, ndmin=2)
+        except (TypeError, ValueError) as e:
+            raise PayloadError(f"Malformed msgpack rows: {e}") from None
+        _check_shape(features, feature_names)
+        return features
+
+    return _records_to_matrix(records, feature_names, dtype, "Record")
+
+
+def decode_arrow(body, feature_names=FEATURE_NAMES, dtype=np.float64):
+    """Read an Arrow IPC stream or file, picking the feature columns by name.
+
+    Columns are read as zero-copy views of the body and written once, in schema order,
+    into the feature matrix.
+    """
+    buffer = pa.py_buffer(body)
+    try:
+        if body[:6] == b"ARROW1":
+            table = pa.ipc.open_file(buffer).read_all()
+        else:
+            table = pa.ipc.open_stream(buffer).read_all()
+    except pa.ArrowInvalid as e:
+        raise PayloadError(f"Body is not a valid Arrow IPC payload: {e}") from None
+
+    missing = [name for name in feature_names if name not in table.column_names]
+    if missing:
+        raise PayloadError(f"Arrow table is missing the columns {missing}")
+
+    features = np.empty((table.num_rows, len(feature_names)), dtype=dtype)
+    for j, name in enumerate(feature_names):
+        try:
+            features[:, j] = table.column(name).to_numpy()
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            raise PayloadError(f"Column '{name}' is not numeric: {e}") from None
+    return features
+
+
+def _records_to_matrix(records, feature_names, dtype, unit, first_record=1):
+    features = np.empty((len(records), len(feature_names)), dtype=dtype)
+
+    # Fast path: flatten the values in schema order and let NumPy convert them (numeric
+    # strings included) in a single assignment. Anything unusual falls through to a
+    # record-by-record pass that also pinpoints the offending record.
+    try:
+        features.reshape(-1)[:] = [
+            record[name] for record in records for name in feature_names
+        ]
+        return features
+    except (KeyError, TypeError, ValueError):
+        pass
+
+    for i, record in enumerate(records):
+        location = f"{unit} {i + first_record}"
+        if not isinstance(record, dict):
+            raise PayloadError(f"{location} is not an object")
+        features[i] = _decode_record(record, feature_names, location)
+    return features
+
+
+def _decode_record(record, feature_names, location):
+    row = []
+    for name in feature_names:
+        value = record.get(name)
+        if value is None:
+            row.append(math.nan)
+            continue
+        try:
+            row.append(float(value))
+        except (TypeError, ValueError):
+            raise PayloadError(
+                f"{location} has a non-numeric value for '{name}': {value!r}"
+            ) from None
+    return row
+
+
+def _check_shape(features, feature_names):
+    if features.ndim != 2 or features.shape[1] != len(feature_names):
+        raise PayloadError(
+            f"Expected an (n, {len(feature_names)}) array of {list(feature_names)}, "
+            f"got shape {features.shape}"
+        )
+
+
+def _is_number(field):
+    try:
+        float(field)
+        return True
+    except ValueError:
+        return not field.strip()
+
+
+##############
+## Encoders ##
+##############
+
+
+def encode_jsonlines(labels):
+    return b"".join(_dumps({OUTPUT_COLUMN: label}) + b"\n" for label in labels.tolist())
+
+
+def encode_csv(labels):
+    output = io.StringIO()
+    csv.writer(output, lineterminator="\n").writerows([label] for label in labels.tolist())
+    return output.getvalue().encode("utf-8")
+
+
+def encode_npy(labels):
+    output = io.BytesIO()
+    np.save(output, np.asarray(labels), allow_pickle=False)
+    return output.getvalue()
+
+
+def encode_msgpack(labels):
+    return msgpack.packb(labels.tolist())
+
+
+def encode_arrow(labels):
+    table = pa.table({OUTPUT_COLUMN: pa.array(labels.tolist())})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# Content types accepted on input (Content-Type) and offered on output (Accept). Clients that
+# accept anything get the first entry of ENCODERS.
+DECODERS = {JSONLINES: decode_jsonlines, CSV: decode_csv, NPY: decode_npy}
+ENCODERS = {JSONLINES: encode_jsonlines, CSV: encode_csv, NPY: encode_npy}
+
+if msgpack is not None:
+    DECODERS[MSGPACK] = DECODERS["application/msgpack"] = decode_msgpack
+    ENCODERS[MSGPACK] = encode_msgpack
+
+if pa is not None:
+    DECODERS[ARROW_STREAM] = DECODERS[ARROW_FILE] = decode_arrow
+    ENCODERS[ARROW_STREAM] = encode_arrow
@@ -10,22 +10,139 @@
 #
 # Parameter                Environment Variable              Default Value
 # ---------                --------------------              -------------
-# number of workers        MODEL_SERVER_WORKERS              the number of CPU cores
+# worker/thread preset     MODEL_SERVER_PROFILE              throughput (a single-threaded worker
+#                                                            per core; latency gives fewer
+#                                                            workers with up to 4 threads each)
+# number of workers        MODEL_SERVER_WORKERS              CPU cores / threads per worker
+# threads per worker       MODEL_SERVER_THREADS              CPU cores / workers, or the preset's
+# pin workers to cores     MODEL_SERVER_CPU_AFFINITY         false
 # timeout                  MODEL_SERVER_TIMEOUT              60 seconds
+# model artifact directory MODEL_DIR                         /opt/ml/model
+# multi-model root         MODEL_SERVER_MODELS_DIR           unset (serve MODEL_DIR only)
+# multi-model cache size   MODEL_SERVER_MODEL_CACHE_MB       512 MB of artifacts per worker
+# artifact change check    MODEL_RELOAD_INTERVAL             5 seconds
+# load model before fork   MODEL_SERVER_PRELOAD              false
+# streamed response chunk  MODEL_SERVER_STREAM_CHUNK_ROWS    0 (responses are not streamed)
+# micro-batch wait         MODEL_SERVER_BATCH_WAIT_MS        0 (requests are not batched)
+# micro-batch size         MODEL_SERVER_BATCH_MAX_ROWS       256 rows
+# prediction cache entries MODEL_SERVER_PREDICTION_CACHE_SIZE 0 (predictions are not cached)
+# prediction cache TTL     MODEL_SERVER_PREDICTION_CACHE_TTL 0 (entries do not expire)
+# shared metrics directory MODEL_SERVER_METRICS_DIR          /tmp/model_server_metrics
+# tree evaluation engine   MODEL_SERVER_TREE_ENGINE          auto (NumPy engine where faster;
+#                                                            numpy or native to force one)
+# in-flight requests       MODEL_SERVER_MAX_INFLIGHT_REQUESTS 0 (per worker; 0 is no limit)
+# in-flight rows           MODEL_SERVER_MAX_INFLIGHT_ROWS    0 (per worker; 0 is no limit)
+# status when full         MODEL_SERVER_REJECT_STATUS        503 (or 429)
+# retry delay when full    MODEL_SERVER_RETRY_AFTER          1 second
+#
+# With MODEL_SERVER_PRELOAD enabled, gunicorn imports wsgi:app (and so pandas, sklearn, xgboost
+# and the model artifacts) once in the master process and forks the workers from it, so the
+# workers share those pages copy-on-write instead of each holding a private copy.
+#
+# Either way, each worker loads the model and predicts a few synthetic batches before it
+# accepts connections (see gunicorn_config.py), and /ping answers 503 until that has worked.
+#
+# With MODEL_SERVER_MODELS_DIR set, each subdirectory of it holds one model's artifacts and
+# /invocations serves the one named by the X-Amzn-SageMaker-Target-Model header ("name" or
+# "name.tar.gz"). Workers load models on first use and evict the least recently used ones once
+# the loaded artifacts exceed MODEL_SERVER_MODEL_CACHE_MB; /metrics adds per-model counters.
+#
+# With the in-flight limits set, a worker that is already working on that many requests (or
+# rows) answers further invocations at once with MODEL_SERVER_REJECT_STATUS and a Retry-After
+# header instead of queueing them. A request may also carry X-Model-Server-Deadline-Ms, a
+# budget counted from when nginx received it; if it runs out before prediction, the request
+# gets a 504 and is not predicted.
+#
+# The CPU cores are those this process may run on, capped by the container's CPU quota. Each
+# worker's XGBoost nthread and OpenMP/BLAS thread pools (OMP_NUM_THREADS and friends, unless
+# they are set already) are sized to its share, so workers x threads doesn't oversubscribe
+# them. With MODEL_SERVER_CPU_AFFINITY, worker i is also pinned to its own slice of the cores.
 
-import multiprocessing
 import os
+import shutil
 import signal
 import sys
 import subprocess
 
+import metrics
+
 
 _DIR_TO_FILE = os.path.dirname(os.path.abspath(__file__))
 
-cpu_count = multiprocessing.cpu_count()
+# Threads per worker in the latency preset.
+LATENCY_THREADS = 4
+# Thread pool sizes exported to the workers; XGBoost's own is set from MODEL_SERVER_THREADS.
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def available_cpus():
+    """The number of cores this process can use: its CPU affinity mask, capped by a cgroup
+    (v2 or v1) CPU quota such as `docker run --cpus`."""
+    if hasattr(os, "sched_getaffinity"):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        cores = min(cores, max(1, int(quota)))
+    return cores
+
+
+def _cgroup_cpu_quota():
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = f.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = f.read().strip()
+        except OSError:
+            return None
+    if quota in ("max", "-1"):
+        return None
+    return int(quota) / int(period)
+
+
+def worker_layout(workers=None, threads=None, profile="throughput", cores=None):
+    """Split `cores` into (workers, threads per worker), filling in whichever isn't given."""
+    if profile not in ("throughput", "latency"):
+        raise ValueError(f"Unknown MODEL_SERVER_PROFILE '{profile}'; use throughput or latency")
+    if cores is None:
+        cores = available_cpus()
+    if workers is None and threads is None:
+        threads = min(cores, LATENCY_THREADS) if profile == "latency" else 1
+    if workers is None:
+        workers = max(1, cores // threads)
+    if threads is None:
+        threads = max(1, cores // workers)
+    return workers, threads
+
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+cpu_count = available_cpus()
 
 model_server_timeout = os.environ.get("MODEL_SERVER_TIMEOUT", 60)
-model_server_workers = int(os.environ.get("MODEL_SERVER_WORKERS", cpu_count))
+model_server_profile = os.environ.get("MODEL_SERVER_PROFILE", "throughput")
+model_server_workers, model_server_threads = worker_layout(
+    _env_int("MODEL_SERVER_WORKERS"),
+    _env_int("MODEL_SERVER_THREADS"),
+    model_server_profile,
+    cpu_count,
+)
+model_server_preload = os.environ.get("MODEL_SERVER_PRELOAD", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+model_server_cpu_affinity = os.environ.get(
+    "MODEL_SERVER_CPU_AFFINITY", "false"
+).lower() in ("1", "true", "yes")
 
 
 def sigterm_handler(nginx_pid, gunicorn_pid):
@@ -41,8 +158,62 @@ def sigterm_handler(nginx_pid, gunicorn_pid):
     sys.exit(0)
 
 
+def gunicorn_command(bind, workers=None, preload=None):
+    if workers is None:
+        workers = model_server_workers
+    if preload is None:
+        preload = model_server_preload
+
+    command = [
+        "gunicorn",
+        "-c",
+        os.path.join(_DIR_TO_FILE, "gunicorn_config.py"),
+        "--timeout",
+        str(model_server_timeout),
+        "-k",
+        "gevent",
+        "-b",
+        bind,
+        "-w",
+        str(workers),
+    ]
+    if preload:
+        command.append("--preload")
+    command.append("wsgi:app")
+    return command
+
+
+def gunicorn_env(workers=None, env=None):
+    """The environment to start gunicorn with: `env` (by default this process's) plus the
+    thread settings for `workers` workers, which inference.py and gunicorn_config.py read."""
+    if workers is None:
+        threads = model_server_threads
+    else:
+        _, threads = worker_layout(
+            workers, _env_int("MODEL_SERVER_THREADS"), model_server_profile, cpu_count
+        )
+    env = dict(os.environ if env is None else env)
+    for name in THREAD_ENV_VARS:
+        env.setdefault(name, str(threads))
+    env["MODEL_SERVER_THREADS"] = str(threads)
+    return env
+
+
 def start_server():
-    print("Starting the inference server with {} workers.".format(model_server_workers))
+    print(
+        "Starting the inference server with {} workers of {} threads on {} cores "
+        "(profile: {}, preload: {}, CPU affinity: {}).".format(
+            model_server_workers,
+            model_server_threads,
+            cpu_count,
+            model_server_profile,
+            model_server_preload,
+            model_server_cpu_affinity,
+        )
+    )
+
+    # start the /metrics totals from zero rather than from a previous run's worker files
+    shutil.rmtree(metrics.METRICS_DIR, ignore_errors=True)
 
     # link the log streams to stdout/err so they will be logged to the container logs
     subprocess.check_call(["ln", "-sf", "/dev/stdout", "/var/log/nginx/access.log"])
@@ -50,18 +221,7 @@ def start_server():
 
     nginx = subprocess.Popen(["nginx", "-c", os.path.join(_DIR_TO_FILE, "nginx.conf")])
     gunicorn = subprocess.Popen(
-        [
-            "gunicorn",
-            "--timeout",
-            str(model_server_timeout),
-            "-k",
-            "gevent",
-            "-b",
-            "unix:/tmp/gunicorn.sock",
-            "-w",
-            str(model_server_workers),
-            "wsgi:app",
-        ]
+        gunicorn_command("unix:/tmp/gunicorn.sock"), env=gunicorn_env()
     )
 
     signal.signal(signal.SIGTERM, lambda a, b: sigterm_handler(nginx.pid, gunicorn.pid))
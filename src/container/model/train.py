@@ -1,14 +1,25 @@
+import hashlib
+import io
 import json
 import logging
 import os
 import sys
+import tarfile
+import tempfile
+import time
 
 import numpy as np
 import pandas as pd
 import joblib
+import xgboost as xgb
+from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import MinMaxScaler, LabelEncoder
 from xgboost import XGBClassifier
 
+import hyperparameter_search
+from bundle import BUNDLE_NAME, ModelBundle, write_bundle
+from feature_cache import FeatureCache, fingerprint_files
+
 
 sys.path.append("..")  # Do not remove this
 logging.basicConfig(level=logging.DEBUG)
@@ -25,11 +36,111 @@ SAVE_DIR = os.path.join(CONTAINER_DIR_PREFIX, "model")
 HYPERPARAMS_PATH = os.path.join(
     CONTAINER_DIR_PREFIX, "input/config/hyperparameters.json"
 )
+INPUT_DATA_CONFIG_PATH = os.path.join(
+    CONTAINER_DIR_PREFIX, "input/config/inputdataconfig.json"
+)
 FAILURE_DIR = os.path.join(CONTAINER_DIR_PREFIX, "failure")
+CHECKPOINT_DIR = os.path.join(CONTAINER_DIR_PREFIX, "checkpoints")
+PREVIOUS_MODEL_DIR = os.path.join(CONTAINER_DIR_PREFIX, "input/data/model")
 
 TARGET_VARIABLE = "class"
 MODEL_OBJECTIVE = "multi:softprob"
 EVAL_METRIC = "merror"
+FEATURE_DTYPE = np.float32
+
+# Settings for the training container itself rather than for XGBoost. They are passed in
+# hyperparameters.json alongside the model hyperparameters and removed before those reach
+# XGBoost; anything not given takes the default below.
+#
+#   ingestion_mode  "memory"           read iris.csv into one DataFrame (the original workflow)
+#                   "streaming"        read every file in the channel in chunks and build a
+#                                      QuantileDMatrix from them; memory grows with the number
+#                                      of rows only by the quantized matrix (~1 byte per value)
+#                   "external_memory"  as "streaming", but the quantized pages are cached on disk
+#                                      so peak memory depends on chunk_rows alone
+#   chunk_rows      rows per chunk in the streaming modes
+#   feature_cache_dir  when set, the scaled features, encoded labels and fitted scaler/encoder
+#                   are kept in this directory under a fingerprint of the channel's files and
+#                   reused by later runs on the same data that see the same directory. Under
+#                   /opt/ml/checkpoints (e.g. /opt/ml/checkpoints/features) it survives a spot
+#                   job's restart, but not into other jobs: submit_training gives every job
+#                   its own checkpoint location. Pipe mode input can't be fingerprinted
+#                   without consuming it, so it is never cached.
+#   search_trials   hyperparameter search (see below): number of sampled configurations
+#   search_eta      keep the best 1/search_eta of the trials after each rung of the search
+#   search_workers  trial processes; 0 uses one per core (threads are split between them)
+#   search_seed     seed for sampling configurations and for the validation split
+#   validation_fraction  share of the rows held out to score trials on
+#   early_stopping_rounds  stop a trial once its validation loss stalls for this many rounds
+#   training_mode   "fit"       train n_estimators rounds on all rows (the original workflow)
+#                   "budgeted"  train against the job's time limit (see below)
+#                   "incremental"  append trees to the previous model (see below)
+#   max_runtime_seconds  the job's MaxRuntimeInSeconds; 0 reads TRAINING_MAX_RUNTIME_SECONDS,
+#                   which submit_training sets from the stopping condition
+#   budget_reserve_seconds  time kept back from the limit for saving and uploading the model
+#   tree_method     "auto" picks exact for small data and hist otherwise; or exact/approx/hist
+#   checkpoint_dir  where budgeted training checkpoints its booster; SageMaker syncs
+#                   /opt/ml/checkpoints to S3 when the job has a checkpoint config, and puts
+#                   it back when a spot job restarts
+#   checkpoint_interval  rounds between checkpoints
+#
+# Budgeted training holds out validation_fraction of the rows and boosts until n_estimators
+# rounds, until the validation loss stops improving (early_stopping_rounds) or until the next
+# round would run past the time limit, whichever comes first, and keeps the rounds up to the
+# best validation score. It resumes from the checkpoint if one from the same configuration and
+# data is there, with the job time the earlier runs used (as of their last checkpoint) taken off
+# the budget. It needs ingestion_mode "memory".
+#
+#   previous_model_dir  where incremental training finds the previous model: its three
+#                   .joblib files or the model.tar.gz of the job that produced them (the
+#                   optional "model" channel, which submit_training fills with the latest
+#                   completed job's artifacts)
+#   incremental_rounds  trees appended per class by incremental training
+#   max_out_of_range_fraction  incremental training fails if more than this share of the
+#                   new feature values lie outside the range the previous scaler was fitted
+#                   on; the model should then be rebuilt from scratch
+#
+# Incremental training keeps the previous scaler and label encoder, checks that the new data
+# has the same columns and no unknown classes, and boosts incremental_rounds more rounds on
+# the new rows only, starting from the previous booster. Without a previous model it trains
+# from scratch as "fit" does. It needs ingestion_mode "memory".
+#
+# Hyperparameter search runs when any hyperparameter is given as a range instead of a value:
+# a list of choices ("max_depth": "[3, 5, 8]") or bounds ("learning_rate": "{\"min\": 0.01,
+# \"max\": 0.3, \"log\": true}"; integer bounds sample integers). Trials are trained in
+# rungs of successive halving up to n_estimators rounds; the best configuration is then
+# refitted on all rows with the number of rounds it needed, and saved together with a log of
+# every trial (search_trials.json). Search needs ingestion_mode "memory".
+#
+# Whether the channel is a directory of files (File mode) or a series of FIFOs (Pipe mode) is
+# read from inputdataconfig.json, which SageMaker writes for every job. The TRAINING_INPUT_MODE
+# environment variable overrides it, e.g. to train locally from a named pipe (see local_pipe.py).
+TRAINING_OPTION_DEFAULTS = {
+    "ingestion_mode": "memory",
+    "chunk_rows": 100000,
+    "feature_cache_dir": "",
+    "search_trials": 16,
+    "search_eta": 3,
+    "search_workers": 0,
+    "search_seed": 0,
+    "validation_fraction": 0.2,
+    "early_stopping_rounds": 10,
+    "training_mode": "fit",
+    "max_runtime_seconds": 0,
+    "budget_reserve_seconds": 60,
+    "tree_method": "auto",
+    "checkpoint_dir": CHECKPOINT_DIR,
+    "checkpoint_interval": 10,
+    "previous_model_dir": PREVIOUS_MODEL_DIR,
+    "incremental_rounds": 10,
+    "max_out_of_range_fraction": 0.1,
+}
+PIPE_WAIT_SECONDS = 300
+
+# Above this many feature values (rows x features) exact split finding is slower than
+# histograms for little gain; and each XGBoost thread is given at least this many rows.
+EXACT_MAX_VALUES = 1_000_000
+ROWS_PER_THREAD = 10_000
 
 ############################
 ## Main Training Workflow ##
@@ -40,31 +151,109 @@ def train(
     input_data_dir, model_save_dir, hyperparams_path=None, failure_output_dir=None
 ):
     logging.info("Starting training.")
-
-    logging.info("Getting training data.")
-    train_fname = os.path.join(DATA_DIR, "iris.csv")
-    data = pd.read_csv(train_fname)
-    features = data.drop(TARGET_VARIABLE, axis=1)
-    targets = data[TARGET_VARIABLE]
+    start = time.monotonic()
 
     logging.info("Getting hyperparameters.")
     if not hyperparams_path:
         hyperparams_path = HYPERPARAMS_PATH
 
     hyperparams = get_hyperparameters(hyperparams_path)
+    options, hyperparams = split_training_options(hyperparams)
+    logging.info(f"Training options: {options}")
+    search_space, hyperparams = hyperparameter_search.split_search_space(hyperparams)
 
     logging.info("Casting data types for hyperparameters.")
     hyperparams = cast_dtypes_for_hyperparameters(hyperparams)
 
-    logging.info("Scaling features.")
-    scaler = MinMaxScaler()
-    scaled = scaler.fit_transform(features)
-    joblib.dump(scaler, os.path.join(SAVE_DIR, "scaler.joblib"))
+    input_mode = get_input_mode(DATA_CHANNEL.rstrip("/"))
+    if input_mode == "Pipe":
+        channel = PipeChannel(input_data_dir)
+        if options["ingestion_mode"] == "memory":
+            logging.info("Pipe mode input is always ingested in chunks; using streaming.")
+            options["ingestion_mode"] = "streaming"
+    else:
+        channel = FileChannel(input_data_dir)
+
+    if options["training_mode"] not in ("fit", "budgeted", "incremental"):
+        raise ValueError(f"Unknown training_mode '{options['training_mode']}'")
+    if search_space and options["training_mode"] != "fit":
+        raise ValueError("Hyperparameter search needs training_mode 'fit'")
+    if (search_space or options["training_mode"] != "fit") and options[
+        "ingestion_mode"
+    ] != "memory":
+        raise ValueError(
+            "Hyperparameter search, budgeted and incremental training need "
+            "ingestion_mode 'memory'"
+        )
+
+    if options["training_mode"] == "budgeted":
+        max_runtime = options["max_runtime_seconds"] or int(
+            os.environ.get("TRAINING_MAX_RUNTIME_SECONDS", 0)
+        )
+        if not max_runtime:
+            raise ValueError(
+                "Budgeted training needs max_runtime_seconds or TRAINING_MAX_RUNTIME_SECONDS"
+            )
+        deadline = start + max_runtime - options["budget_reserve_seconds"]
+        logging.info(
+            f"Time budget: {deadline - time.monotonic():.0f}s of the {max_runtime}s limit."
+        )
 
-    logging.info("Encoding target variable.")
-    label_encoder = LabelEncoder()
-    targets = label_encoder.fit_transform(targets)
-    joblib.dump(label_encoder, os.path.join(SAVE_DIR, "label_encoder.joblib"))
+    if search_space:
+        scaler, label_encoder, model, trial_log = search_in_memory(
+            input_data_dir, hyperparams, search_space, options
+        )
+        with open(os.path.join(model_save_dir, "search_trials.json"), "w") as f:
+            json.dump(trial_log, f, indent=2)
+    elif options["training_mode"] == "budgeted":
+        scaler, label_encoder, model = train_budgeted(
+            input_data_dir, hyperparams, options, start, deadline
+        )
+    elif options["training_mode"] == "incremental":
+        scaler, label_encoder, model = train_incremental(
+            input_data_dir, hyperparams, options
+        )
+    elif options["ingestion_mode"] == "memory":
+        scaler, label_encoder, model = train_in_memory(
+            input_data_dir, hyperparams, feature_cache_dir=options["feature_cache_dir"]
+        )
+    elif options["ingestion_mode"] in ("streaming", "external_memory"):
+        feature_cache = None
+        if options["feature_cache_dir"] and isinstance(channel, FileChannel):
+            feature_cache = open_feature_cache(
+                options["feature_cache_dir"], channel.files, "streaming"
+            )
+        elif options["feature_cache_dir"]:
+            logging.info("Not using the feature cache: Pipe mode input isn't cached.")
+        scaler, label_encoder, model = train_streaming(
+            channel,
+            hyperparams,
+            chunk_rows=options["chunk_rows"],
+            external_memory=options["ingestion_mode"] == "external_memory",
+            feature_cache=feature_cache,
+        )
+    else:
+        raise ValueError(f"Unknown ingestion_mode '{options['ingestion_mode']}'")
+
+    joblib.dump(scaler, os.path.join(model_save_dir, "scaler.joblib"))
+    joblib.dump(label_encoder, os.path.join(model_save_dir, "label_encoder.joblib"))
+    joblib.dump(model, os.path.join(model_save_dir, "model.joblib"))
+    # What the inference server loads; the joblib files above stay for incremental training
+    # and for older servers.
+    write_bundle(
+        os.path.join(model_save_dir, BUNDLE_NAME),
+        ModelBundle.from_artifacts(model, scaler, label_encoder),
+    )
+
+    logging.info("Training complete.")
+
+    return
+
+
+def train_in_memory(input_data_dir, hyperparams, feature_cache_dir=""):
+    scaled, targets, scaler, label_encoder = load_in_memory(
+        input_data_dir, feature_cache_dir
+    )
 
     logging.info("Training model.")
     model = XGBClassifier(
@@ -75,11 +264,282 @@ def train(
     )
     model.fit(scaled, targets)
     logging.info(f"Model Performance ({EVAL_METRIC}) = {model.score(scaled, targets)}")
-    joblib.dump(model, os.path.join(SAVE_DIR, "model.joblib"))
 
-    logging.info("Training complete.")
+    return scaler, label_encoder, model
 
-    return
+
+def search_in_memory(input_data_dir, hyperparams, search_space, options):
+    if "n_estimators" in search_space:
+        raise ValueError(
+            "n_estimators is the search's round budget and can't be searched over; "
+            "early stopping picks the number of rounds"
+        )
+    scaled, targets, scaler, label_encoder = load_in_memory(
+        input_data_dir, options["feature_cache_dir"]
+    )
+    train_features, valid_features, train_targets, valid_targets = train_test_split(
+        scaled,
+        targets,
+        test_size=options["validation_fraction"],
+        random_state=options["search_seed"],
+        stratify=targets,
+    )
+
+    rng = np.random.default_rng(options["search_seed"])
+    n_classes = len(label_encoder.classes_)
+    trials = []
+    for _ in range(options["search_trials"]):
+        sampled = cast_dtypes_for_hyperparameters(
+            hyperparameter_search.sample(search_space, rng)
+        )
+        trials.append(
+            (sampled, native_params({**hyperparams, **sampled}, n_classes=n_classes))
+        )
+
+    start = time.perf_counter()
+    best, trial_log = hyperparameter_search.successive_halving(
+        train_features,
+        train_targets,
+        valid_features,
+        valid_targets,
+        trials,
+        max_rounds=hyperparams.get("n_estimators", 100),
+        eta=options["search_eta"],
+        early_stopping_rounds=options["early_stopping_rounds"],
+        workers=options["search_workers"],
+    )
+    best_result = [entry for entry in trial_log if entry["trial"] == best][-1]
+    logging.info(
+        f"Search finished in {time.perf_counter() - start:.1f}s; best trial {best} "
+        f"({trials[best][0]}) at {best_result['best_iteration'] + 1} rounds, validation "
+        f"{EVAL_METRIC} {best_result['validation_merror']:.5f}."
+    )
+
+    logging.info("Refitting the best configuration on all rows.")
+    model = XGBClassifier(
+        **{
+            **hyperparams,
+            **trials[best][0],
+            "n_estimators": best_result["best_iteration"] + 1,
+        },
+        objective=MODEL_OBJECTIVE,
+        eval_metric=EVAL_METRIC,
+    )
+    model.fit(scaled, targets)
+
+    return scaler, label_encoder, model, trial_log
+
+
+def train_budgeted(input_data_dir, hyperparams, options, start, deadline):
+    scaled, targets, scaler, label_encoder = load_in_memory(
+        input_data_dir, options["feature_cache_dir"]
+    )
+    train_features, valid_features, train_targets, valid_targets = train_test_split(
+        scaled,
+        targets,
+        test_size=options["validation_fraction"],
+        random_state=hyperparams.get("random_state", 0),
+        stratify=targets,
+    )
+
+    tree_method, nthread = choose_tree_method(
+        *train_features.shape, os.cpu_count() or 1, options["tree_method"]
+    )
+    params = native_params(hyperparams, n_classes=len(label_encoder.classes_))
+    params["tree_method"] = tree_method
+    params.pop("n_jobs", None)
+    params["nthread"] = hyperparams.get("nthread", hyperparams.get("n_jobs", nthread))
+    params["eval_metric"] = [EVAL_METRIC, "mlogloss"]
+    logging.info(
+        f"Training {len(train_features)} rows with tree_method={tree_method}, "
+        f"nthread={params['nthread']}; validating on {len(valid_features)}."
+    )
+
+    dtrain = xgb.DMatrix(train_features, label=train_targets)
+    dvalid = xgb.DMatrix(valid_features, label=valid_targets)
+    checkpoint = BoosterCheckpoint(
+        options["checkpoint_dir"],
+        options["checkpoint_interval"],
+        signature={"params": params, "data": digest_arrays(scaled, targets)},
+        started=start,
+    )
+    booster = checkpoint.load()
+    if checkpoint.resumed_seconds:
+        # The job's time limit covers the runs before a spot interruption too.
+        deadline -= checkpoint.resumed_seconds
+        logging.info(
+            f"{checkpoint.resumed_seconds:.0f}s of the time limit were used before the "
+            f"restart; {max(0.0, deadline - time.monotonic()):.0f}s left."
+        )
+    if not checkpoint.finished:
+        done = booster.num_boosted_rounds() if booster is not None else 0
+        booster = xgb.train(
+            params,
+            dtrain,
+            num_boost_round=max(0, hyperparams.get("n_estimators", 100) - done),
+            xgb_model=booster,
+            evals=[(dvalid, "validation")],
+            early_stopping_rounds=options["early_stopping_rounds"],
+            callbacks=[TimeBudget(deadline), checkpoint],
+            verbose_eval=False,
+        )
+
+    # The best round is taken from the checkpoint's loss history rather than from XGBoost's
+    # early stopping, which only knows about the rounds since the last resume.
+    rounds = int(np.argmin(checkpoint.history)) + 1
+    booster = booster[:rounds]
+    logging.info(
+        f"Keeping {rounds} rounds. Model Performance (validation {EVAL_METRIC}) = "
+        f"{classification_error(booster, dvalid)}"
+    )
+
+    return scaler, label_encoder, classifier_from_booster(booster)
+
+
+def train_incremental(input_data_dir, hyperparams, options):
+    with tempfile.TemporaryDirectory() as extract_dir:
+        previous_dir = find_previous_model(options["previous_model_dir"], extract_dir)
+        if previous_dir is None:
+            logging.info("No previous model found; training from scratch.")
+            return train_in_memory(
+                input_data_dir, hyperparams, options["feature_cache_dir"]
+            )
+        logging.info(f"Loading the previous model from {previous_dir}.")
+        scaler = joblib.load(os.path.join(previous_dir, "scaler.joblib"))
+        label_encoder = joblib.load(os.path.join(previous_dir, "label_encoder.joblib"))
+        previous = joblib.load(os.path.join(previous_dir, "model.joblib"))
+
+    logging.info("Getting training data.")
+    data = pd.read_csv(os.path.join(input_data_dir, "iris.csv"))
+    features = data.drop(TARGET_VARIABLE, axis=1)
+    check_compatible(
+        scaler,
+        label_encoder,
+        features,
+        data[TARGET_VARIABLE],
+        options["max_out_of_range_fraction"],
+    )
+    dtrain = xgb.DMatrix(
+        scaler.transform(features),
+        label=label_encoder.transform(data[TARGET_VARIABLE]),
+    )
+
+    booster = previous.get_booster()
+    previous_rounds = booster.num_boosted_rounds()
+    logging.info(
+        f"Previous model: {previous_rounds} rounds; {EVAL_METRIC} on the new data = "
+        f"{classification_error(booster, dtrain)}"
+    )
+    params = native_params(hyperparams, n_classes=len(label_encoder.classes_))
+    booster = xgb.train(
+        params,
+        dtrain,
+        num_boost_round=options["incremental_rounds"],
+        xgb_model=booster,
+    )
+    # An early-stopped previous model carries its best_iteration, which would make the
+    # predictor ignore the appended trees.
+    booster.set_attr(best_iteration=None, best_score=None)
+    logging.info(
+        f"Appended {booster.num_boosted_rounds() - previous_rounds} rounds. "
+        f"Model Performance ({EVAL_METRIC}) = {classification_error(booster, dtrain)}"
+    )
+
+    return scaler, label_encoder, classifier_from_booster(booster)
+
+
+def load_in_memory(input_data_dir, feature_cache_dir=""):
+    train_fname = os.path.join(input_data_dir, "iris.csv")
+    feature_cache = None
+    if feature_cache_dir:
+        feature_cache = open_feature_cache(feature_cache_dir, [train_fname], "memory")
+
+    if feature_cache is not None and feature_cache.exists():
+        scaled, targets, scaler, label_encoder = feature_cache.load()
+    else:
+        logging.info("Getting training data.")
+        data = pd.read_csv(train_fname)
+        features = data.drop(TARGET_VARIABLE, axis=1)
+        targets = data[TARGET_VARIABLE]
+
+        logging.info("Scaling features.")
+        scaler = MinMaxScaler()
+        scaled = scaler.fit_transform(features)
+
+        logging.info("Encoding target variable.")
+        label_encoder = LabelEncoder()
+        targets = label_encoder.fit_transform(targets)
+
+        if feature_cache is not None:
+            # XGBoost trains on float32 whatever it is given, so storing float32 changes
+            # nothing about the model.
+            feature_cache.save(scaled, targets, scaler, label_encoder, dtype=FEATURE_DTYPE)
+
+    return scaled, targets, scaler, label_encoder
+
+
+def train_streaming(
+    channel, hyperparams, chunk_rows, external_memory=False, feature_cache=None
+):
+    logging.info(f"Streaming {channel} in chunks of {chunk_rows} rows.")
+
+    features = targets = None
+    if feature_cache is not None and feature_cache.exists():
+        features, targets, scaler, label_encoder = feature_cache.load()
+    else:
+        # First pass: fit the scaler's min/max and collect the labels one chunk at a time.
+        logging.info("Fitting scaler and label encoder incrementally.")
+        scaler = MinMaxScaler()
+        labels = set()
+        n_rows = 0
+        for chunk in channel.iter_chunks(chunk_rows):
+            scaler.partial_fit(chunk.drop(TARGET_VARIABLE, axis=1))
+            labels.update(chunk[TARGET_VARIABLE].unique())
+            n_rows += len(chunk)
+        label_encoder = LabelEncoder().fit(np.array(sorted(labels), dtype=object))
+        logging.info(f"Read {n_rows} rows with {len(labels)} classes.")
+
+        if feature_cache is not None:
+            # One more pass writes the preprocessed data to the cache; XGBoost then reads
+            # that instead of parsing the CSVs again on each of its own passes.
+            logging.info("Writing preprocessed features to the feature cache.")
+            features, targets = feature_cache.open_arrays(
+                n_rows, scaler.n_features_in_, dtype=FEATURE_DTYPE
+            )
+            start = 0
+            for chunk in channel.iter_chunks(chunk_rows):
+                end = start + len(chunk)
+                features[start:end] = scaler.transform(chunk.drop(TARGET_VARIABLE, axis=1))
+                targets[start:end] = label_encoder.transform(chunk[TARGET_VARIABLE])
+                start = end
+            feature_cache.finish(features, targets, scaler, label_encoder)
+
+    # Second pass (repeated by XGBoost as it needs): scaled, encoded chunks into a DMatrix.
+    with tempfile.TemporaryDirectory() as cache_dir:
+        logging.info("Building training matrix.")
+        cache_prefix = os.path.join(cache_dir, "train") if external_memory else None
+        if features is not None:
+            iterator = ArrayIterator(features, targets, chunk_rows, cache_prefix)
+        else:
+            iterator = ChunkIterator(
+                channel, chunk_rows, scaler, label_encoder, cache_prefix
+            )
+        if external_memory:
+            dtrain = xgb.DMatrix(iterator)
+        else:
+            dtrain = xgb.QuantileDMatrix(iterator)
+
+        logging.info("Training model.")
+        params = native_params(hyperparams, n_classes=len(label_encoder.classes_))
+        booster = xgb.train(
+            params, dtrain, num_boost_round=hyperparams.get("n_estimators", 100)
+        )
+        train_error = float(booster.eval(dtrain).rsplit(":", 1)[1])
+        logging.info(f"Model Performance ({EVAL_METRIC}) = {train_error}")
+        # Free the matrix and its iterator while their external memory cache files still exist.
+        del dtrain, iterator
+
+    return scaler, label_encoder, classifier_from_booster(booster)
 
 
 ###############################
@@ -87,6 +547,370 @@ def train(
 ###############################
 
 
+class ChunkIterator(xgb.DataIter):
+    """Feeds the channel's CSV data to XGBoost one scaled, label-encoded chunk at a time."""
+
+    def __init__(self, channel, chunk_rows, scaler, label_encoder, cache_prefix=None):
+        self.channel = channel
+        self.chunk_rows = chunk_rows
+        self.scaler = scaler
+        self.label_encoder = label_encoder
+        self._chunks = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._chunks is None:
+            self._chunks = self.channel.iter_chunks(self.chunk_rows)
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        input_data(
+            data=self.scaler.transform(chunk.drop(TARGET_VARIABLE, axis=1)).astype(
+                FEATURE_DTYPE, copy=False
+            ),
+            label=self.label_encoder.transform(chunk[TARGET_VARIABLE]),
+        )
+        return True
+
+    def reset(self):
+        self._chunks = None
+
+
+class ArrayIterator(xgb.DataIter):
+    """Feeds already preprocessed (e.g. memory-mapped, cached) arrays to XGBoost in chunks."""
+
+    def __init__(self, features, targets, chunk_rows, cache_prefix=None):
+        self.features = features
+        self.targets = targets
+        self.chunk_rows = chunk_rows
+        self._start = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._start >= len(self.features):
+            return False
+        end = self._start + self.chunk_rows
+        input_data(
+            data=np.asarray(self.features[self._start : end]),
+            label=np.asarray(self.targets[self._start : end]),
+        )
+        self._start = end
+        return True
+
+    def reset(self):
+        self._start = 0
+
+
+class TimeBudget(xgb.callback.TrainingCallback):
+    """Stops boosting when the next round would likely end past `deadline` (a
+    time.monotonic() value), going by the slowest round so far."""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self._last = None
+        self._slowest = 0.0
+        super().__init__()
+
+    def before_training(self, model):
+        self._last = time.monotonic()
+        return model
+
+    def after_iteration(self, model, epoch, evals_log):
+        now = time.monotonic()
+        self._slowest = max(self._slowest, now - self._last)
+        self._last = now
+        if now + self._slowest > self.deadline:
+            logging.info(
+                f"Stopping after {model.num_boosted_rounds()} rounds: out of time budget."
+            )
+            return True
+        return False
+
+
+class BoosterCheckpoint(xgb.callback.TrainingCallback):
+    """Saves the booster to `directory` every `interval` rounds, replacing the previous
+    checkpoint. Alongside it go the validation loss of every round so far, whether training
+    had finished, the job time used so far (counted from `started`, a time.monotonic() value,
+    plus that of the runs before a restart) and a signature of the data and parameters, so
+    that a resumed job never continues from an unrelated booster."""
+
+    def __init__(self, directory, interval, signature, started):
+        self.directory = directory
+        self.interval = interval
+        self.signature = json.loads(json.dumps(signature))
+        self.started = started
+        # Job time used by earlier runs, as of their last checkpoint.
+        self.resumed_seconds = 0.0
+        self.model_path = os.path.join(directory, "booster.ubj")
+        self.state_path = os.path.join(directory, "booster.json")
+        self.history = []
+        self.finished = False
+        self._resumed_history = []
+        super().__init__()
+
+    def load(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        if state["signature"] != self.signature:
+            logging.info("Ignoring checkpoint from a different training configuration.")
+            return None
+        booster = xgb.Booster(model_file=self.model_path)
+        self.history = self._resumed_history = state["history"]
+        self.finished = state["finished"]
+        self.resumed_seconds = state.get("elapsed_seconds", 0.0)
+        logging.info(
+            f"Resuming from checkpoint at {booster.num_boosted_rounds()} rounds"
+            f"{' (finished)' if self.finished else ''}."
+        )
+        return booster
+
+    def after_iteration(self, model, epoch, evals_log):
+        self.history = self._resumed_history + list(evals_log["validation"]["mlogloss"])
+        if model.num_boosted_rounds() % self.interval == 0:
+            self.save(model)
+        return False
+
+    def after_training(self, model):
+        self.finished = True
+        self.save(model)
+        return model
+
+    def save(self, model):
+        os.makedirs(self.directory, exist_ok=True)
+        # Write-then-rename, so an interruption mid-save leaves the previous checkpoint intact.
+        model.save_model(self.model_path + ".tmp.ubj")
+        os.replace(self.model_path + ".tmp.ubj", self.model_path)
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(
+                {
+                    "signature": self.signature,
+                    "history": self.history,
+                    "finished": self.finished,
+                    "elapsed_seconds": self.resumed_seconds
+                    + time.monotonic()
+                    - self.started,
+                },
+                f,
+            )
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+
+def digest_arrays(*arrays):
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype.str}{array.shape}".encode("utf-8"))
+        digest.update(array.data)
+    return digest.hexdigest()
+
+
+class FileChannel:
+    """A File mode channel: every file under the channel directory, read in order."""
+
+    def __init__(self, channel_dir):
+        self.files = list_channel_files(channel_dir)
+
+    def __str__(self):
+        return f"{len(self.files)} training file(s)"
+
+    def iter_chunks(self, chunk_rows):
+        return iter_csv_chunks(self.files, chunk_rows)
+
+
+class PipeChannel:
+    """A Pipe mode channel. SageMaker streams the channel's S3 objects, concatenated, through
+    FIFOs named <channel dir>_0, _1, ...; each pass over the data opens the next one."""
+
+    def __init__(self, channel_dir):
+        self.fifo_prefix = channel_dir.rstrip("/")
+        self.passes = 0
+
+    def __str__(self):
+        return f"the {self.fifo_prefix}_<n> pipes"
+
+    def iter_chunks(self, chunk_rows):
+        fifo_path = f"{self.fifo_prefix}_{self.passes}"
+        self.passes += 1
+        wait_for_path(fifo_path, PIPE_WAIT_SECONDS)
+        with open(fifo_path) as fifo:
+            yield from iter_csv_stream_chunks(fifo, chunk_rows)
+
+
+def open_feature_cache(cache_dir, files, ingestion):
+    # The two ingestion paths fit the scaler on differently parsed data (float64 vs float32),
+    # so each gets its own entries.
+    start = time.perf_counter()
+    fingerprint = fingerprint_files(
+        files,
+        ingestion=ingestion,
+        target=TARGET_VARIABLE,
+        feature_dtype=np.dtype(FEATURE_DTYPE).name,
+    )
+    feature_cache = FeatureCache(cache_dir, fingerprint)
+    logging.info(
+        f"Fingerprinted {len(files)} training file(s) as {fingerprint[:12]} in "
+        f"{time.perf_counter() - start:.3f}s; feature cache "
+        f"{'hit' if feature_cache.exists() else 'miss'}."
+    )
+    return feature_cache
+
+
+def find_previous_model(model_dir, extract_dir):
+    if os.path.exists(os.path.join(model_dir, "model.joblib")):
+        return model_dir
+    archive = os.path.join(model_dir, "model.tar.gz")
+    if not os.path.exists(archive):
+        return None
+    # Extraction filters only exist in newer Python patch releases.
+    filter_args = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    with tarfile.open(archive) as tar:
+        tar.extractall(extract_dir, **filter_args)
+    return extract_dir
+
+
+def check_compatible(
+    scaler, label_encoder, features, labels, max_out_of_range_fraction
+):
+    expected = list(scaler.feature_names_in_)
+    if list(features.columns) != expected:
+        raise ValueError(
+            f"The new data has columns {list(features.columns)}, but the previous model "
+            f"was trained on {expected}"
+        )
+    unknown = set(labels.unique()) - set(label_encoder.classes_)
+    if unknown:
+        raise ValueError(
+            f"The new data has classes the previous model doesn't know: {sorted(unknown)}; "
+            "train from scratch to add classes"
+        )
+    out_of_range = (
+        ((features < scaler.data_min_) | (features > scaler.data_max_)).to_numpy().mean()
+    )
+    if out_of_range > max_out_of_range_fraction:
+        raise ValueError(
+            f"{out_of_range:.1%} of the new feature values are outside the range the "
+            "previous scaler was fitted on; train from scratch to refit it"
+        )
+    if out_of_range:
+        logging.warning(
+            f"{out_of_range:.1%} of the new feature values are outside the range the "
+            "previous scaler was fitted on."
+        )
+
+
+def get_input_mode(channel_name, input_data_config_path=INPUT_DATA_CONFIG_PATH):
+    if os.environ.get("TRAINING_INPUT_MODE"):
+        return os.environ["TRAINING_INPUT_MODE"]
+    try:
+        with open(input_data_config_path) as f:
+            channel_config = json.load(f).get(channel_name, {})
+    except FileNotFoundError:
+        return "File"
+    return channel_config.get("TrainingInputMode", "File")
+
+
+def wait_for_path(path, timeout):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{path} did not appear within {timeout}s")
+        time.sleep(0.1)
+
+
+def list_channel_files(channel_dir):
+    # Only CSVs: the job's output path sits under the train prefix, so the channel can also
+    # hold model.tar.gz files from earlier jobs.
+    files = []
+    for root, _, names in os.walk(channel_dir):
+        files += [
+            os.path.join(root, name)
+            for name in names
+            if name.lower().endswith(".csv") and not name.startswith(".")
+        ]
+    if not files:
+        raise ValueError(f"No training files found in {channel_dir}")
+    return sorted(files)
+
+
+def iter_csv_chunks(files, chunk_rows):
+    for fname in files:
+        columns = pd.read_csv(fname, nrows=0).columns
+        dtypes = {name: FEATURE_DTYPE for name in columns if name != TARGET_VARIABLE}
+        dtypes[TARGET_VARIABLE] = str
+        for chunk in pd.read_csv(fname, chunksize=chunk_rows, dtype=dtypes):
+            yield chunk
+
+
+def iter_csv_stream_chunks(lines, chunk_rows):
+    # The stream is the channel's CSV objects back to back, so every object after the first
+    # repeats the header line; those repeats are dropped. (Each object must end with a newline,
+    # or its last row runs into the next object's header.)
+    header = next(lines, None)
+    if header is None:
+        return
+    header = header.rstrip("\r\n") + "\n"
+    columns = header.strip().split(",")
+    dtypes = {name: FEATURE_DTYPE for name in columns if name != TARGET_VARIABLE}
+    dtypes[TARGET_VARIABLE] = str
+
+    chunk = []
+    for line in lines:
+        if not line.strip() or line.rstrip("\r\n") + "\n" == header:
+            continue
+        chunk.append(line)
+        if len(chunk) == chunk_rows:
+            yield pd.read_csv(io.StringIO(header + "".join(chunk)), dtype=dtypes)
+            chunk = []
+    if chunk:
+        yield pd.read_csv(io.StringIO(header + "".join(chunk)), dtype=dtypes)
+
+
+def native_params(hyperparams, n_classes):
+    # Let the sklearn wrapper translate the hyperparameters into XGBoost's native names, so both
+    # ingestion modes accept exactly the same hyperparameters.
+    params = XGBClassifier(
+        **hyperparams, objective=MODEL_OBJECTIVE, eval_metric=EVAL_METRIC
+    ).get_xgb_params()
+    params = {key: value for key, value in params.items() if value is not None}
+    params["num_class"] = n_classes
+    # QuantileDMatrix and external memory both require the hist tree method.
+    params["tree_method"] = "hist"
+    return params
+
+
+def choose_tree_method(n_rows, n_features, cores, tree_method="auto"):
+    # approx is never picked automatically: hist finds the same kind of splits faster.
+    if tree_method == "auto":
+        tree_method = "exact" if n_rows * n_features <= EXACT_MAX_VALUES else "hist"
+    nthread = max(1, min(cores, n_rows // ROWS_PER_THREAD))
+    return tree_method, nthread
+
+
+def classification_error(booster, dmatrix):
+    predicted = booster.predict(dmatrix).argmax(axis=1)
+    return float(np.mean(predicted != dmatrix.get_label()))
+
+
+def classifier_from_booster(booster):
+    # Wrap the booster in an XGBClassifier so model.joblib looks the same to inference.py
+    # whichever way it was trained.
+    model = XGBClassifier(objective=MODEL_OBJECTIVE, eval_metric=EVAL_METRIC)
+    model.load_model(booster.save_raw())
+    return model
+
+
+def split_training_options(hyperparams):
+    options = dict(TRAINING_OPTION_DEFAULTS)
+    hyperparams = dict(hyperparams or {})
+    for key in TRAINING_OPTION_DEFAULTS:
+        if key in hyperparams:
+            options[key] = type(TRAINING_OPTION_DEFAULTS[key])(hyperparams.pop(key))
+    return options, hyperparams
+
+
 def get_hyperparameters(hyperparameters_path):
     try:
         hyperparameters = {}
@@ -95,7 +919,10 @@ def get_hyperparameters(hyperparameters_path):
             json_file.close()
             hyperparameters = json_string
         for key, value in hyperparameters.items():
-            hyperparameters[key] = json.loads(value)
+            try:
+                hyperparameters[key] = json.loads(value)
+            except ValueError:  # Plain strings such as "streaming" are kept as they are.
+                pass
         return hyperparameters
     except Exception as e:
         logging.exception("Exception occured while getting hyperparameters. Aborting.")
@@ -0,0 +1,205 @@
+import json
+import time
+
+import numpy as np
+
+
+# Fields of a TreeEnsemble, in the order they are stored in a model bundle.
+ARRAY_FIELDS = (
+    "feature",
+    "threshold",
+    "left",
+    "right",
+    "default_left",
+    "value",
+    "roots",
+    "tree_class",
+    "base_margin",
+)
+BLOCK_NODES = 1 << 20
+
+
+class TreeEnsemble:
+    """A booster's trees as flat NumPy arrays, evaluated for a whole batch at once.
+
+    All trees' nodes are concatenated; `roots` holds each tree's first node and `tree_class`
+    the output group its leaves add to. Traversal moves every (row, tree) pair down one level
+    per step; leaves point back to themselves, so after `max_depth` steps every pair sits on
+    its leaf. Splits follow XGBoost's rules exactly (go left if the float32 feature value is
+    below the float32 threshold, or if it is missing and the node defaults left).
+    """
+
+    def __init__(
+        self,
+        feature,
+        threshold,
+        left,
+        right,
+        default_left,
+        value,
+        roots,
+        tree_class,
+        base_margin,
+        max_depth,
+    ):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.default_left = default_left
+        self.value = value
+        self.roots = roots
+        self.tree_class = tree_class
+        self.base_margin = base_margin
+        self.max_depth = int(max_depth)
+        # Sums each row's leaf values into its class margins with one matrix product.
+        self._class_matrix = np.zeros((len(roots), len(base_margin)), dtype=np.float64)
+        self._class_matrix[np.arange(len(roots)), tree_class] = 1.0
+
+    @classmethod
+    def from_booster(cls, booster, iteration_range=(0, 0)):
+        """Export `booster`, or None if it uses something this engine doesn't implement
+        (categorical splits, multiple parallel trees, or a non-classification objective)."""
+        model = json.loads(booster.save_raw(raw_format="json"))["learner"]
+        objective = model["objective"]["name"]
+        gbtree = model["gradient_booster"]
+        if gbtree.get("name") != "gbtree" or not (
+            objective.startswith("multi:") or objective == "binary:logistic"
+        ):
+            return None
+        trees_model = gbtree["model"]
+        if int(trees_model["gbtree_model_param"]["num_parallel_tree"]) != 1:
+            return None
+
+        n_groups = max(1, int(model["learner_model_param"]["num_class"]))
+        start, end = iteration_range
+        end = end or booster.num_boosted_rounds()
+        trees = trees_model["trees"][start * n_groups : end * n_groups]
+        tree_class = trees_model["tree_info"][start * n_groups : end * n_groups]
+        if any(any(tree["split_type"]) for tree in trees):
+            return None
+
+        feature, threshold, left, right, default_left, value = [], [], [], [], [], []
+        roots, max_depth, offset = [], 0, 0
+        for tree in trees:
+            n_nodes = len(tree["left_children"])
+            tree_left = np.asarray(tree["left_children"], dtype=np.int64)
+            tree_right = np.asarray(tree["right_children"], dtype=np.int64)
+            is_leaf = tree_left == -1
+            node_ids = np.arange(n_nodes)
+            roots.append(offset)
+            feature.append(np.where(is_leaf, 0, tree["split_indices"]))
+            threshold.append(np.where(is_leaf, np.inf, tree["split_conditions"]))
+            left.append(np.where(is_leaf, node_ids, tree_left) + offset)
+            right.append(np.where(is_leaf, node_ids, tree_right) + offset)
+            default_left.append(np.asarray(tree["default_left"], dtype=bool) | is_leaf)
+            # A leaf's output is stored in split_conditions.
+            value.append(np.where(is_leaf, tree["split_conditions"], 0.0))
+            max_depth = max(max_depth, _depth(tree_left, tree_right))
+            offset += n_nodes
+
+        def concat(parts, dtype):
+            return np.concatenate(parts).astype(dtype) if parts else np.empty(0, dtype)
+
+        ensemble = cls(
+            feature=concat(feature, np.int32),
+            threshold=concat(threshold, np.float32),
+            left=concat(left, np.int32),
+            right=concat(right, np.int32),
+            default_left=concat(default_left, bool),
+            value=concat(value, np.float32),
+            roots=np.asarray(roots, dtype=np.int32),
+            tree_class=np.asarray(tree_class, dtype=np.int32),
+            base_margin=np.zeros(n_groups, dtype=np.float64),
+            max_depth=max_depth,
+        )
+        # The intercept's representation in the saved model differs between XGBoost versions;
+        # recover it in margin space from XGBoost's own output instead of interpreting it.
+        probe = np.zeros((1, booster.num_features()), dtype=np.float32)
+        native = booster.inplace_predict(
+            probe, predict_type="margin", iteration_range=iteration_range
+        ).reshape(1, -1)
+        ensemble.base_margin = (native - ensemble.margins(probe))[0].astype(np.float64)
+        return ensemble
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in ARRAY_FIELDS}
+
+    def margins(self, features):
+        """Raw scores, (n_rows, n_groups), for a float32 feature matrix."""
+        # Traversal state is one node index per (row, tree); bound it by going through large
+        # batches a block of rows at a time.
+        block_rows = max(1, BLOCK_NODES // max(1, len(self.roots)))
+        if features.shape[0] <= block_rows:
+            return self._block_margins(features)
+        return np.concatenate(
+            [
+                self._block_margins(features[start : start + block_rows])
+                for start in range(0, features.shape[0], block_rows)
+            ]
+        )
+
+    def _block_margins(self, features):
+        n_rows = features.shape[0]
+        nodes = np.broadcast_to(self.roots, (n_rows, len(self.roots))).copy()
+        rows = np.arange(n_rows)[:, None]
+        has_missing = np.isnan(features).any()
+        for _ in range(self.max_depth):
+            values = features[rows, self.feature[nodes]]
+            go_left = values < self.threshold[nodes]
+            if has_missing:
+                missing = np.isnan(values)
+                go_left[missing] = self.default_left[nodes[missing]]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.value[nodes] @ self._class_matrix + self.base_margin
+
+    def predict_indices(self, features):
+        margins = self.margins(features)
+        if margins.shape[1] == 1:
+            return (margins[:, 0] > 0).astype(np.intp)
+        return np.argmax(margins, axis=1)
+
+
+def _depth(left, right):
+    depth, frontier = 0, [0]
+    while True:
+        frontier = [
+            child
+            for node in frontier
+            for child in (left[node], right[node])
+            if child != -1
+        ]
+        if not frontier:
+            return depth
+        depth += 1
+
+
+def fastest_batch_limit(ensemble, native_fn, n_features, batch_sizes, seed=0):
+    """Largest of `batch_sizes` up to which `ensemble` predicts faster than `native_fn` and
+    gives the same classes, or 0 when the NumPy engine never wins (or ever disagrees).
+
+    Inputs are drawn from [-0.1, 1.1), covering the scaled range the booster was trained on
+    and a little beyond it, with a share of missing values.
+    """
+    rng = np.random.default_rng(seed)
+    probe = rng.uniform(-0.1, 1.1, size=(max(batch_sizes), n_features)).astype(np.float32)
+    probe[rng.random(probe.shape) < 0.02] = np.nan
+    if not np.array_equal(ensemble.predict_indices(probe), native_fn(probe)):
+        return 0
+
+    limit = 0
+    for batch_size in sorted(batch_sizes):
+        batch = probe[:batch_size]
+        if _best_time(ensemble.predict_indices, batch) >= _best_time(native_fn, batch):
+            break
+        limit = batch_size
+    return limit
+
+
+def _best_time(fn, batch, repeat=20):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(batch)
+        best = min(best, time.perf_counter() - start)
+    return best
@@ -1,3 +1,17 @@
+import gc
+import os
+
 import app as my_app
+import inference
 
 app = my_app.app
+
+# When gunicorn runs with --preload this module is imported once in the master, before the
+# workers are forked. Load the artifacts here so every worker inherits them, and move everything
+# allocated so far out of the collector's reach so gc passes in the workers don't touch (and so
+# un-share) those pages. In multi-model mode there is no single model to load up front; the
+# workers load theirs on first use.
+if os.environ.get("MODEL_SERVER_PRELOAD", "false").lower() in ("1", "true", "yes"):
+    if inference.models is None:
+        inference.current_bundle()
+    gc.freeze()
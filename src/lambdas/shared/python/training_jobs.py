@@ -0,0 +1,35 @@
+import datetime
+
+# Training jobs are named "<model name>-<timestamp>" (see submit_training).
+JOB_TIMESTAMP_FORMAT = "%Y-%m-%d-%H-%M-%S"
+
+
+def find_latest_training_job(sagemaker, model_name):
+    """The name of the latest completed training job of `model_name`, or None if there is
+    none. `sagemaker` is a boto3 SageMaker client."""
+    # NameContains alone would also match other models whose names contain this one (e.g.
+    # "iris-v2-<timestamp>" for "iris"), so keep paging until a job of this model turns up.
+    pages = sagemaker.get_paginator("list_training_jobs").paginate(
+        SortBy="CreationTime",
+        SortOrder="Descending",
+        StatusEquals="Completed",
+        NameContains=model_name,
+        PaginationConfig={"PageSize": 10},
+    )
+    for page in pages:
+        for job in page["TrainingJobSummaries"]:
+            if is_training_job_of(job["TrainingJobName"], model_name):
+                return job["TrainingJobName"]
+    return None
+
+
+def is_training_job_of(training_job_name, model_name):
+    if not training_job_name.startswith(f"{model_name}-"):
+        return False
+    try:
+        datetime.datetime.strptime(
+            training_job_name[len(model_name) + 1 :], JOB_TIMESTAMP_FORMAT
+        )
+    except ValueError:
+        return False
+    return True
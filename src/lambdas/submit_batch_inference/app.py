@@ -1,31 +1,64 @@
 import boto3
+import botocore.exceptions
 import datetime
 
+from transform_plan import inspect_input, plan_transform
 
-def find_latest_training_job(model_name):
-    client = boto3.client("sagemaker")
-    models = client.list_training_jobs(
-        SortBy="CreationTime",
-        SortOrder="Descending",
-        MaxResults=100,
-        StatusEquals="Completed",
-        NameContains=model_name,
-    )
-    return models["TrainingJobSummaries"][0]["TrainingJobName"]
-
-
-def make_model_from_training_job(model_name):
-    client = boto3.client("sagemaker")
-    job_details = client.describe_training_job(TrainingJobName=model_name)
-    model = client.create_model(
-        ModelName=model_name,
-        PrimaryContainer=dict(
-            Image=job_details["AlgorithmSpecification"]["TrainingImage"],
-            ModelDataUrl=job_details["ModelArtifacts"]["S3ModelArtifacts"],
-        ),
-        ExecutionRoleArn=job_details["RoleArn"],
+# From the shared Lambda layer (src/lambdas/shared).
+from training_jobs import JOB_TIMESTAMP_FORMAT, find_latest_training_job
+
+# Created once per Lambda execution environment and reused by warm invocations.
+sagemaker = boto3.client("sagemaker")
+s3 = boto3.client("s3")
+
+# model name -> (latest training job name, SageMaker model made from it). A warm invocation
+# only has to look up the latest job; if it's the one cached, its model is known to exist.
+_resolved_models = {}
+
+
+def model_exists(sagemaker_model_name):
+    pages = sagemaker.get_paginator("list_models").paginate(NameContains=sagemaker_model_name)
+    return any(
+        model["ModelName"] == sagemaker_model_name
+        for page in pages
+        for model in page["Models"]
     )
-    return model_name
+
+
+def make_model_from_training_job(training_job_name):
+    job_details = sagemaker.describe_training_job(TrainingJobName=training_job_name)
+    try:
+        sagemaker.create_model(
+            ModelName=training_job_name,
+            PrimaryContainer=dict(
+                Image=job_details["AlgorithmSpecification"]["TrainingImage"],
+                ModelDataUrl=job_details["ModelArtifacts"]["S3ModelArtifacts"],
+            ),
+            ExecutionRoleArn=job_details["RoleArn"],
+        )
+    except botocore.exceptions.ClientError:
+        # Another invocation may have created it since model_exists() was checked.
+        if not model_exists(training_job_name):
+            raise
+    return training_job_name
+
+
+def resolve_model(model_name):
+    """The SageMaker model for the latest completed training job of `model_name`, created
+    from the job if it doesn't exist yet."""
+    training_job_name = find_latest_training_job(sagemaker, model_name)
+    if training_job_name is None:
+        raise ValueError(f"No completed training job found for model {model_name}")
+    cached = _resolved_models.get(model_name)
+    if cached is not None and cached[0] == training_job_name:
+        return cached[1]
+
+    if model_exists(training_job_name):
+        sagemaker_model_name = training_job_name
+    else:
+        sagemaker_model_name = make_model_from_training_job(training_job_name)
+    _resolved_models[model_name] = (training_job_name, sagemaker_model_name)
+    return sagemaker_model_name
 
 
 def lambda_handler(event, context):
@@ -34,23 +67,37 @@ def lambda_handler(event, context):
     inference_data_uri = event["inference_data_uri"]
     resource_config = event["resource_config"]
 
-    client = boto3.client("sagemaker")
-
     inference_job_name = (
-        f"{model_name}-{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}"
+        f"{model_name}-{datetime.datetime.now().strftime(JOB_TIMESTAMP_FORMAT)}"
     )
 
-    latest_training_job_name = find_latest_training_job(model_name)
-    try:
-        sagemaker_model_name = make_model_from_training_job(latest_training_job_name)
-    except:  # Most likely a result of the model already existing.
-        sagemaker_model_name = latest_training_job_name
+    # The instance count in the resource config is an upper bound: the job is sized to the
+    # input (see transform_plan.py) to finish soonest within max_cost_usd, if given.
+    object_sizes, record_bytes = inspect_input(s3, inference_data_uri)
+    if not object_sizes:
+        raise ValueError(f"No input objects under {inference_data_uri}")
+    plan = plan_transform(
+        object_sizes,
+        record_bytes,
+        resource_config["instance_type"],
+        resource_config["instance_count"],
+        max_cost_usd=resource_config.get("max_cost_usd"),
+        instance_vcpus=resource_config.get("instance_vcpus"),
+        hourly_price_usd=resource_config.get("hourly_price_usd"),
+    )
+    print(
+        f"{len(object_sizes)} objects, {sum(object_sizes)} bytes, ~{record_bytes:.0f} bytes "
+        f"per record: {plan}"
+    )
+
+    sagemaker_model_name = resolve_model(model_name)
 
-    response = client.create_transform_job(
+    response = sagemaker.create_transform_job(
         TransformJobName=inference_job_name,
         ModelName=sagemaker_model_name,
         BatchStrategy="MultiRecord",
-        MaxPayloadInMB=6,
+        MaxPayloadInMB=plan.max_payload_mb,
+        MaxConcurrentTransforms=plan.max_concurrent_transforms,
         TransformInput={
             "DataSource": {
                 "S3DataSource": {
@@ -64,6 +111,8 @@ def lambda_handler(event, context):
         TransformOutput={"S3OutputPath": f"{inference_data_uri}/inference_output",},
         TransformResources={
             "InstanceType": resource_config["instance_type"],
-            "InstanceCount": resource_config["instance_count"],
+            "InstanceCount": plan.instance_count,
         },
+        # Predict and respond in chunks so MultiRecord payloads don't have to be held in full.
+        Environment={"MODEL_SERVER_STREAM_CHUNK_ROWS": "1000"},
     )
@@ -0,0 +1,148 @@
+import heapq
+import math
+import urllib.parse
+
+
+# vCPUs and approximate on-demand batch transform price (USD per instance-hour, us-east-1) of
+# the instance types this pipeline is normally run on. Other types need "instance_vcpus" and
+# "hourly_price_usd" in the resource config.
+INSTANCE_TYPES = {
+    "ml.m5.large": (2, 0.115),
+    "ml.m5.xlarge": (4, 0.23),
+    "ml.m5.2xlarge": (8, 0.461),
+    "ml.m5.4xlarge": (16, 0.922),
+    "ml.c5.large": (2, 0.102),
+    "ml.c5.xlarge": (4, 0.204),
+    "ml.c5.2xlarge": (8, 0.408),
+    "ml.c5.4xlarge": (16, 0.816),
+}
+
+# Limits of CreateTransformJob: MaxPayloadInMB x MaxConcurrentTransforms may not exceed this.
+MAX_PAYLOAD_MB = 100
+# Cost model. Every instance is billed from provisioning to the end of the job; each request
+# pays a fixed round trip on top of the scoring time, and one worker of the inference server
+# (one per vCPU) scores JSON Lines at about this rate.
+STARTUP_SECONDS = 300
+REQUEST_OVERHEAD_SECONDS = 0.05
+WORKER_BYTES_PER_SECOND = 5e6
+# A request must finish well inside the server's 60s worker timeout (MODEL_SERVER_TIMEOUT).
+REQUEST_SECONDS_LIMIT = 30
+# Bytes read from the largest object to estimate the average record size.
+SAMPLE_BYTES = 1 << 20
+
+
+class TransformPlan:
+    def __init__(self, instance_count, max_concurrent_transforms, max_payload_mb, seconds, cost):
+        self.instance_count = instance_count
+        self.max_concurrent_transforms = max_concurrent_transforms
+        self.max_payload_mb = max_payload_mb
+        # Estimated wall-clock time and cost of the job.
+        self.seconds = seconds
+        self.cost = cost
+
+    def __repr__(self):
+        return (
+            f"TransformPlan(instances={self.instance_count}, "
+            f"concurrency={self.max_concurrent_transforms}, payload={self.max_payload_mb}MB, "
+            f"~{self.seconds:.0f}s, ~${self.cost:.2f})"
+        )
+
+
+def inspect_input(s3, uri):
+    """Object sizes under the S3 prefix `uri` and the average record (line) size, estimated
+    from the start of the largest object. `s3` is a boto3 S3 client."""
+    parsed = urllib.parse.urlparse(uri)
+    bucket, prefix = parsed.netloc, parsed.path.lstrip("/")
+    sizes = {}
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Size"] > 0:
+                sizes[obj["Key"]] = obj["Size"]
+
+    record_bytes = 0.0
+    if sizes:
+        key = max(sizes, key=sizes.get)
+        sample = s3.get_object(
+            Bucket=bucket, Key=key, Range=f"bytes=0-{SAMPLE_BYTES - 1}"
+        )["Body"].read()
+        record_bytes = len(sample) / max(1, sample.count(b"\n"))
+    return sorted(sizes.values(), reverse=True), record_bytes
+
+
+def plan_transform(
+    object_sizes,
+    record_bytes,
+    instance_type,
+    max_instance_count,
+    max_cost_usd=None,
+    instance_vcpus=None,
+    hourly_price_usd=None,
+):
+    """The instance count, concurrency and payload size that finish the job soonest within
+    `max_cost_usd`, or the cheapest plan if none fits the cap.
+
+    Batch transform hands each input object to a single instance, so instances beyond the
+    number of objects would idle; the objects are assumed to be spread over the instances
+    largest first, each to the least loaded one.
+    """
+    vcpus, price = INSTANCE_TYPES.get(instance_type, (None, None))
+    vcpus = instance_vcpus or vcpus
+    price = hourly_price_usd or price
+    if vcpus is None or price is None:
+        raise ValueError(
+            f"Unknown instance type {instance_type}; give instance_vcpus and hourly_price_usd"
+        )
+
+    # A payload must hold at least one record. The inference server runs one worker per vCPU,
+    # so more concurrent requests than that would only queue.
+    min_payload = max(1, math.ceil(record_bytes / 1e6))
+    concurrency = max(1, min(vcpus, MAX_PAYLOAD_MB // min_payload))
+    max_payload = max(min_payload, MAX_PAYLOAD_MB // concurrency)
+    payload_sizes = [
+        size
+        for size in range(min_payload, max_payload + 1)
+        if size == min_payload
+        or size * 1e6 / WORKER_BYTES_PER_SECOND <= REQUEST_SECONDS_LIMIT
+    ]
+
+    plans = [
+        estimate(object_sizes, instance_count, concurrency, payload_mb, price)
+        for instance_count in range(1, max(1, min(max_instance_count, len(object_sizes))) + 1)
+        for payload_mb in payload_sizes
+    ]
+
+    affordable = [p for p in plans if max_cost_usd is None or p.cost <= max_cost_usd]
+    if affordable:
+        return min(affordable, key=lambda p: (p.seconds, p.cost, p.instance_count))
+    return min(plans, key=lambda p: (p.cost, p.seconds))
+
+
+def estimate(object_sizes, instance_count, concurrency, payload_mb, hourly_price_usd):
+    """A TransformPlan with the estimated duration and cost of the given settings."""
+    seconds = STARTUP_SECONDS + max(
+        _scoring_seconds(shard, payload_mb * 1e6, concurrency)
+        for shard in _assign(object_sizes, instance_count)
+    )
+    cost = instance_count * hourly_price_usd * seconds / 3600
+    return TransformPlan(instance_count, concurrency, payload_mb, seconds, cost)
+
+
+def _assign(object_sizes, instance_count):
+    shards = [[] for _ in range(instance_count)]
+    loads = [(0, i) for i in range(instance_count)]
+    for size in sorted(object_sizes, reverse=True):
+        load, i = heapq.heappop(loads)
+        shards[i].append(size)
+        heapq.heappush(loads, (load + size, i))
+    return shards
+
+
+def _scoring_seconds(shard, payload_bytes, concurrency):
+    if not shard:
+        return 0.0
+    # Payloads are cut per object, so each object ends with a partial one. The instance's
+    # workers share the requests, but can't finish sooner than its largest single request.
+    requests = sum(math.ceil(size / payload_bytes) for size in shard)
+    work = requests * REQUEST_OVERHEAD_SECONDS + sum(shard) / WORKER_BYTES_PER_SECOND
+    longest = REQUEST_OVERHEAD_SECONDS + min(payload_bytes, max(shard)) / WORKER_BYTES_PER_SECOND
+    return max(work / concurrency, longest)
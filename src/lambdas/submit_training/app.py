@@ -1,5 +1,48 @@
 import boto3
 import datetime
+import json
+import posixpath
+import urllib.parse
+
+# From the shared Lambda layer (src/lambdas/shared).
+from training_jobs import JOB_TIMESTAMP_FORMAT, find_latest_training_job
+
+# Created once per Lambda execution environment and reused by warm invocations.
+sagemaker = boto3.client("sagemaker")
+
+
+def encode_hyperparameters(hyperparameters):
+    # SageMaker only takes string values. train.py json.loads each one back, so everything
+    # but plain strings (numbers, booleans, search ranges) is sent as JSON.
+    return {
+        key: value if isinstance(value, str) else json.dumps(value)
+        for key, value in hyperparameters.items()
+    }
+
+
+def default_output_uri(train_data_uri):
+    """Where model artifacts go when the event doesn't say: "model_artifacts" next to the
+    train prefix."""
+    parsed = urllib.parse.urlparse(train_data_uri)
+    parent = posixpath.dirname(parsed.path.strip("/"))
+    return f"s3://{parsed.netloc}/{posixpath.join(parent, 'model_artifacts')}"
+
+
+def matches_prefix(uri, prefix_uri):
+    # An S3Prefix channel takes every key that starts with its prefix, not only the keys
+    # "in the folder": s3://bucket/train also matches s3://bucket/training_output/....
+    uri, prefix_uri = urllib.parse.urlparse(uri), urllib.parse.urlparse(prefix_uri)
+    return uri.netloc == prefix_uri.netloc and uri.path.strip("/").startswith(
+        prefix_uri.path.strip("/")
+    )
+
+
+def find_latest_model_artifacts(model_name):
+    training_job_name = find_latest_training_job(sagemaker, model_name)
+    if training_job_name is None:
+        return None
+    job_details = sagemaker.describe_training_job(TrainingJobName=training_job_name)
+    return job_details["ModelArtifacts"]["S3ModelArtifacts"]
 
 
 def lambda_handler(event, context):
@@ -12,39 +55,86 @@ def lambda_handler(event, context):
     train_data_uri = event["train_data_uri"]
     resource_config = event["resource_config"]
     use_spot_training = event["use_spot_training"]
+    # "File" downloads the whole prefix before train.py starts; "Pipe" streams it through FIFOs.
+    training_input_mode = event.get("training_input_mode", "File")
+    # Passed to train.py as TRAINING_MAX_RUNTIME_SECONDS, so budgeted training can finish and
+    # save a model before SageMaker stops the job.
+    max_runtime_seconds = event.get("max_runtime_seconds", 900)
+    max_wait_seconds = event.get("max_wait_seconds", 1000)
+    # Training options for train.py (see its header), sent as hyperparameters.
+    hyperparameters = event.get("hyperparameters", {})
+    # With a checkpoint location, /opt/ml/checkpoints is synced to S3 during the job and
+    # restored when a spot job resumes after an interruption.
+    checkpoint_uri = event.get("checkpoint_uri")
+    # Model artifacts must stay out of the train channel, or later jobs are fed earlier
+    # model.tar.gz files along with the data (Pipe mode streams every object it matches into
+    # train.py, whatever it is).
+    output_uri = event.get("output_uri") or default_output_uri(train_data_uri)
+    if matches_prefix(output_uri, train_data_uri):
+        raise ValueError(f"output_uri {output_uri} is inside the train data {train_data_uri}")
 
     train_job_name = (
-        f"{model_name}-{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}"
+        f"{model_name}-{datetime.datetime.now().strftime(JOB_TIMESTAMP_FORMAT)}"
     )
 
-    client = boto3.client("sagemaker")
+    input_data_config = [
+        {
+            "ChannelName": "train",
+            "DataSource": {
+                "S3DataSource": {
+                    "S3DataType": "S3Prefix",
+                    "S3Uri": f"{train_data_uri}",
+                }
+            },
+        }
+    ]
+    # Incremental training appends to the latest completed job's model, which train.py
+    # reads from the "model" channel; with no earlier job it trains from scratch.
+    if hyperparameters.get("training_mode") == "incremental":
+        previous_model_uri = find_latest_model_artifacts(model_name)
+        if previous_model_uri:
+            input_data_config.append(
+                {
+                    "ChannelName": "model",
+                    "InputMode": "File",
+                    "DataSource": {
+                        "S3DataSource": {
+                            "S3DataType": "S3Prefix",
+                            "S3Uri": previous_model_uri,
+                        }
+                    },
+                }
+            )
+
+    optional_config = {}
+    if checkpoint_uri:
+        optional_config["CheckpointConfig"] = {
+            "S3Uri": f"{checkpoint_uri}/{train_job_name}",
+            "LocalPath": "/opt/ml/checkpoints",
+        }
 
-    response = client.create_training_job(
+    response = sagemaker.create_training_job(
         TrainingJobName=train_job_name,
         AlgorithmSpecification={
             "TrainingImage": training_image,
-            "TrainingInputMode": "File",
+            "TrainingInputMode": training_input_mode,
         },
         RoleArn=role_arn,
-        InputDataConfig=[
-            {
-                "ChannelName": "train",
-                "DataSource": {
-                    "S3DataSource": {
-                        "S3DataType": "S3Prefix",
-                        "S3Uri": f"{train_data_uri}",
-                    }
-                },
-            }
-        ],
-        OutputDataConfig={"S3OutputPath": f"{train_data_uri}/training_output"},
+        HyperParameters=encode_hyperparameters(hyperparameters),
+        InputDataConfig=input_data_config,
+        OutputDataConfig={"S3OutputPath": output_uri},
         ResourceConfig={
             "InstanceType": resource_config["instance_type"],
             "InstanceCount": resource_config["instance_count"],
             "VolumeSizeInGB": resource_config["volume_size"],
         },
         EnableManagedSpotTraining=use_spot_training,
-        StoppingCondition={"MaxRuntimeInSeconds": 900, "MaxWaitTimeInSeconds": 1000,},
+        StoppingCondition={
+            "MaxRuntimeInSeconds": max_runtime_seconds,
+            "MaxWaitTimeInSeconds": max(max_wait_seconds, max_runtime_seconds),
+        },
+        Environment={"TRAINING_MAX_RUNTIME_SECONDS": str(max_runtime_seconds)},
+        **optional_config,
     )
 
     return {"statusCode": 200}
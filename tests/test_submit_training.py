@@ -0,0 +1,46 @@
+import importlib.util
+import json
+import os
+import sys
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_REPO_DIR, "src", "lambdas", "shared", "python"))
+sys.path.insert(0, os.path.join(_REPO_DIR, "src", "container", "model"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import train  # noqa: E402
+
+
+def load_lambda():
+    # Imported by path: both lambdas are modules named "app".
+    spec = importlib.util.spec_from_file_location(
+        "submit_training_app",
+        os.path.join(_REPO_DIR, "src", "lambdas", "submit_training", "app.py"),
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_hyperparameters_round_trip_through_train(tmp_path):
+    hyperparameters = {
+        "learning_rate": {"min": 0.01, "max": 0.3, "log": True},
+        "max_depth": 4,
+        "silent": True,
+        "training_mode": "budgeted",
+    }
+    encoded = load_lambda().encode_hyperparameters(hyperparameters)
+    assert all(isinstance(value, str) for value in encoded.values())
+
+    path = tmp_path / "hyperparameters.json"
+    path.write_text(json.dumps(encoded))
+    assert train.get_hyperparameters(str(path)) == hyperparameters
+
+
+def test_default_output_uri_is_outside_the_train_channel():
+    app = load_lambda()
+    for train_data_uri in ("s3://bucket/train", "s3://bucket/data/train/"):
+        output_uri = app.default_output_uri(train_data_uri)
+        assert not app.matches_prefix(output_uri, train_data_uri)
+    assert app.default_output_uri("s3://bucket/data/train") == "s3://bucket/data/model_artifacts"
+    assert app.matches_prefix("s3://bucket/training_output/job/model.tar.gz", "s3://bucket/train")